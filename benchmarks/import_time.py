@@ -0,0 +1,29 @@
+'''
+Benchmarks the startup time of the pipeline packages, each import is timed in a fresh interpreter
+
+Run from the root directory: python -m benchmarks.import_time
+'''
+import sys
+import subprocess
+import statistics
+
+PACKAGES = ["utils", "modelling"]
+N_RUNS = 5
+TIMER = "import time; start = time.perf_counter(); import {package}; print(time.perf_counter() - start)"
+
+def time_import(package, n_runs=N_RUNS) :
+    '''
+    Returns the import time of package in seconds for each of n_runs fresh interpreters
+    '''
+    times = []
+    for i in range(n_runs) :
+        output = subprocess.run([sys.executable, "-c", TIMER.format(package=package)], \
+                                capture_output=True, text=True, check=True).stdout
+        times.append(float(output.strip().splitlines()[-1]))
+    return times
+
+if __name__ == "__main__" :
+    print("%10s %10s %10s %10s" % ("package", "min (s)", "median (s)", "max (s)"))
+    for package in PACKAGES :
+        times = time_import(package)
+        print("%10s %10.3f %10.3f %10.3f" % (package, min(times), statistics.median(times), max(times)))
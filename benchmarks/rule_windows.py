@@ -0,0 +1,64 @@
+'''
+Benchmarks the aspect window search of rule mining on long synthetic reviews, comparing the
+linear prefix scan in utils.rule_mining against the nested loop search it replaced
+
+Run from the root directory: python -m benchmarks.rule_windows
+'''
+import time
+import numpy as np
+from utils.token_table import TokenTable
+from utils.rule_mining import get_pos_windows, aspect_windows
+
+REVIEW_LENGTHS = [250, 1000, 4000, 16000]
+ASPECT_RATE = 0.05
+POS_CHOICES = ["ADJ", "VERB", "NOUN", "ADV", "DET", "ADP", "PRON", "PUNCT"]
+POS_WEIGHTS = [0.15, 0.15, 0.25, 0.1, 0.1, 0.1, 0.1, 0.05]
+
+def synthetic_review(n_tokens, rng) :
+    '''
+    Returns a TokenTable of random pos tags and the positions of its aspect tokens
+    '''
+    pos = list(rng.choice(POS_CHOICES, size=n_tokens, p=POS_WEIGHTS))
+    text = ["w%d" % i for i in range(n_tokens)]
+    tokens = TokenTable(text, pos, ["XX"] * n_tokens, np.arange(n_tokens) * 4)
+    aspect_index = np.flatnonzero(rng.random(n_tokens) < ASPECT_RATE)
+    return tokens, aspect_index
+
+def nested_loop_windows(tokens, aspect_index, target_pos='ADJ') :
+    '''
+    The previous O(aspects x tokens) window search, kept as the reference result
+    '''
+    pos = [tokens.pos_tag(j) for j in range(len(tokens))]
+    pairs = set()
+    for index in aspect_index :
+        for j in reversed(range(0, index)) :
+            if pos[j] == target_pos or pos[j] == 'VERB' :
+                if j > 1 and (pos[j-1] == 'ADV' or pos[j-1] == 'DET') :
+                    pairs.add((j-1, index+1))
+                else :
+                    pairs.add((j, index+1))
+        for j in range(index, len(pos)) :
+            if pos[j] == target_pos :
+                pairs.add((index+1, j))
+    latest_start = {}
+    for start, end in sorted(pairs) :
+        latest_start[end] = start
+    latest_end = {}
+    for end, start in sorted(latest_start.items(), key=lambda x: (x[1], x[0])) :
+        latest_end[start] = end
+    return sorted(latest_end.items())
+
+def time_call(func, *args) :
+    start = time.perf_counter()
+    result = func(*args)
+    return result, time.perf_counter() - start
+
+if __name__ == "__main__" :
+    rng = np.random.default_rng(12345)
+    print("%8s %8s %12s %12s" % ("tokens", "aspects", "nested (s)", "linear (s)"))
+    for n_tokens in REVIEW_LENGTHS :
+        tokens, aspect_index = synthetic_review(n_tokens, rng)
+        expected, nested_time = time_call(nested_loop_windows, tokens, aspect_index)
+        result, linear_time = time_call(lambda: aspect_windows(aspect_index, get_pos_windows(tokens, 'ADJ')))
+        assert [tuple(pair) for pair in result.tolist()] == expected
+        print("%8d %8d %12.4f %12.4f" % (n_tokens, len(aspect_index), nested_time, linear_time))
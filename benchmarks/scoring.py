@@ -0,0 +1,51 @@
+'''
+Benchmarks review scoring on one million synthetic aspect rows, comparing the vectorized
+utils.scoring.score_reviews against the row by row compute_score loop it replaced. The loop is
+timed on a sample of the rows and scaled up
+
+Run from the root directory: python -m benchmarks.scoring
+'''
+import time
+import numpy as np
+import pandas as pd
+from utils.scoring import compute_score, score_reviews
+
+N_ROWS = 1000000
+LOOP_ROWS = 100000
+# probabilities whose score is next to a half cent, random samples almost never land there
+HALF_CENT_ROWS = [[0.164, 0.02, 0.815], [0.437, 0.218, 0.345]]
+
+def synthetic_predictions(n_rows, rng) :
+    '''
+    Returns a dataframe of n_rows random prob_pos, prob_neu, prob_neg that sum to 1
+    '''
+    probabilities = rng.dirichlet([1, 1, 1], size=n_rows)
+    return pd.DataFrame(probabilities, columns=["prob_pos", "prob_neu", "prob_neg"])
+
+def loop_score_reviews(df) :
+    '''
+    The previous iterrows scorer, kept as the reference result
+    '''
+    scores = []
+    for i, row in df.iterrows() :
+        scores.append(compute_score(row["prob_pos"], row["prob_neu"], row["prob_neg"]))
+    return np.array(scores)
+
+if __name__ == "__main__" :
+    rng = np.random.default_rng(12345)
+    df = synthetic_predictions(N_ROWS, rng)
+
+    start = time.perf_counter()
+    ratings = score_reviews(df)["rating"].to_numpy()
+    vectorized_time = time.perf_counter() - start
+
+    sample = df.iloc[:LOOP_ROWS]
+    start = time.perf_counter()
+    expected = loop_score_reviews(sample)
+    loop_time = (time.perf_counter() - start) * N_ROWS / LOOP_ROWS
+    assert np.array_equal(ratings[:LOOP_ROWS], expected)
+    half_cents = pd.DataFrame(HALF_CENT_ROWS, columns=["prob_pos", "prob_neu", "prob_neg"])
+    assert np.array_equal(score_reviews(half_cents.copy())["rating"].to_numpy(), loop_score_reviews(half_cents))
+
+    print("%10s %14s %16s" % ("rows", "loop (s)", "vectorized (s)"))
+    print("%10d %14.2f %16.4f" % (N_ROWS, loop_time, vectorized_time))
@@ -11,11 +11,13 @@ RESTAURANT_DETAILED_CSV = "data/pipeline/restaurants_detailed.csv"
 REVIEW_CSV = "data/pipeline/reviews.csv"
 PREPROCESSED_CSV = "data/pipeline/reviews_preprocessed.csv"
 RULE_MINED_CSV = "data/pipeline/rule_mined.csv"
+POS_CACHE = "data/pipeline/pos_cache.sqlite"
 POSTPROCESSED_CSV = "data/pipeline/reviews_postprocessed.csv"
 BASELINE_CSV = "data/pipeline/baseline_prediction.csv" 
 ENSEMBLE_CSV = "data/pipeline/ensemble_prediction.csv"
 REVIEW_FINAL = "data/pipeline/reviews_final.csv"
 RESTAURANT_FINAL = "data/pipeline/restaurants_final.csv"
+SCORE_STORE = "data/pipeline/restaurant_scores.sqlite"
 
 if __name__ == "__main__":
     # scrape
@@ -25,16 +27,18 @@ if __name__ == "__main__":
     utils.preprocessing_pipeline(REVIEW_CSV, PREPROCESSED_CSV)
 
     # rule mining
-    utils.rule_mining_pipeline(PREPROCESSED_CSV, RULE_MINED_CSV) 
+    utils.rule_mining_pipeline(PREPROCESSED_CSV, RULE_MINED_CSV, n_process=-1, pos_cache=POS_CACHE)
 
     # postprocessing
     utils.postprocessing_pipeline(RULE_MINED_CSV, POSTPROCESSED_CSV) 
 
     # modelling
-    modelling.base_modelling_pipeline(POSTPROCESSED_CSV, BASELINE_CSV)
-    modelling.meta_modelling_pipeline(BASELINE_CSV, ENSEMBLE_CSV)
+    registry = modelling.default_registry()
+    modelling.base_modelling_pipeline(POSTPROCESSED_CSV, BASELINE_CSV, registry)
+    modelling.meta_modelling_pipeline(BASELINE_CSV, ENSEMBLE_CSV, registry)
 
     # scoring
-    utils.scoring_pipeline(ENSEMBLE_CSV, RESTAURANT_DETAILED_CSV, REVIEW_FINAL, RESTAURANT_FINAL)
+    utils.scoring_pipeline(ENSEMBLE_CSV, PREPROCESSED_CSV, RESTAURANT_DETAILED_CSV, REVIEW_FINAL, RESTAURANT_FINAL, \
+                           score_store=SCORE_STORE)
 
     # ##### dashboard to read data from REVIEW_FINAL, RESTAURANT_FINAL
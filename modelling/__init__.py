@@ -1 +1,3 @@
-from .modelling_pipeline import *
\ No newline at end of file
+from .modelling_pipeline import *
+from .model_registry import *
+from .transform_cache import *
@@ -9,6 +9,8 @@ from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 from nltk.corpus import stopwords
 from gensim.parsing.preprocessing import STOPWORDS
 from nltk.stem import WordNetLemmatizer, PorterStemmer  
+from utils.emoji_replacer import EmojiReplacer
+from utils.postprocessing import LEMMA_CACHE, STEM_CACHE
 
 STOPWORD_SET = list(STOPWORDS.union(set(stopwords.words("english"))))
 NEGATION_TERMS = ["not", "never", "no", "nothing", "neither", "nowhere", "doesn't", "doesn", "isn't", "isn", \
@@ -116,14 +118,16 @@ def get_emoji_sentiment_mapping(UNICODE_EMO, text_pos, text_neg):
 
 EMOJI_GENERIC_MAPPING = get_emoji_sentiment_mapping(UNICODE_EMO, 'good', 'bad')
 EMOJI_UNIQUE_MAPPING = get_emoji_sentiment_mapping(UNICODE_EMO, 'emoji_good', 'emoji_bad')
+EMOJI_GENERIC_REPLACER = EmojiReplacer(EMOJI_GENERIC_MAPPING)
+EMOJI_UNIQUE_REPLACER = EmojiReplacer(EMOJI_UNIQUE_MAPPING)
 
 def clean_phrase(phrase, remove_whitespace=True, remove_stopwords=True, remove_punctuation=True, remove_nonascii=True, \
                  remove_single_characters=True, remove_numbers=True, lemmatize=False, stem=False, convert_emoji_generic=False, \
                  convert_emoji_unique=False):
     if convert_emoji_generic:
-        phrase = replace_emojis(phrase, EMOJI_GENERIC_MAPPING)
+        phrase = EMOJI_GENERIC_REPLACER(phrase)
     if convert_emoji_unique:
-        phrase = replace_emojis(phrase, EMOJI_UNIQUE_MAPPING)
+        phrase = EMOJI_UNIQUE_REPLACER(phrase)
     if remove_whitespace:
         phrase = phrase.strip()
     if remove_stopwords:
@@ -137,9 +141,9 @@ def clean_phrase(phrase, remove_whitespace=True, remove_stopwords=True, remove_p
     if remove_numbers:
         phrase = "".join([i for i in phrase if not i.isdigit()])
     if lemmatize:
-        phrase = " ".join([LEMMATIZER.lemmatize(word) for word in WORD_TOKENIZER.tokenize(phrase)])
+        phrase = " ".join([LEMMA_CACHE(word) for word in WORD_TOKENIZER.tokenize(phrase)])
     if stem:
-        phrase = " ".join([STEMMER.stem(word) for word in WORD_TOKENIZER.tokenize(phrase)])
+        phrase = " ".join([STEM_CACHE(word) for word in WORD_TOKENIZER.tokenize(phrase)])
         
     phrase = " ".join(phrase.split())
     return phrase.lower()
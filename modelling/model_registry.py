@@ -0,0 +1,59 @@
+import time
+
+class ModelRegistry:
+    '''
+    Loads each model on first use and keeps it resident, so a long-lived worker can score many
+    batches while loading every model once
+
+    Parameters:
+        loaders (dict): model name -> function returning the loaded model
+
+    Attributes:
+        stats (dict): model name -> load_seconds and memory_bytes (resident memory added while loading)
+    '''
+    def __init__(self, loaders=None):
+        self._loaders = dict(loaders or {})
+        self._models = {}
+        self.stats = {}
+
+    def register(self, name, loader):
+        '''
+        Adds or replaces the loader of a model, a loaded model of that name is dropped
+        '''
+        self._loaders[name] = loader
+        self.unload(name)
+
+    def get(self, name):
+        '''
+        Returns the model, loading it the first time
+        '''
+        if name not in self._models:
+            import psutil
+            process = psutil.Process()
+            memory = process.memory_info().rss
+            start = time.perf_counter()
+            self._models[name] = self._loaders[name]()
+            self.stats[name] = {"load_seconds": time.perf_counter() - start, \
+                                "memory_bytes": process.memory_info().rss - memory}
+        return self._models[name]
+
+    def __getitem__(self, name):
+        return self.get(name)
+
+    def __contains__(self, name):
+        return name in self._models
+
+    def unload(self, name):
+        '''
+        Drops a loaded model, it is loaded again on next use
+        '''
+        self._models.pop(name, None)
+        self.stats.pop(name, None)
+
+    def report(self):
+        '''
+        Prints the load time and memory of every loaded model
+        '''
+        print("%-20s %10s %12s" % ("model", "load (s)", "memory (MB)"))
+        for name, stats in self.stats.items():
+            print("%-20s %10.2f %12.1f" % (name, stats["load_seconds"], stats["memory_bytes"] / 2 ** 20))
@@ -1,13 +1,13 @@
+import os
+import time
 import pickle
+import numpy as np
 import pandas as pd
-import nltk
-nltk.download('vader_lexicon')
-from nltk.sentiment.vader import SentimentIntensityAnalyzer
-import fasttext
-from scipy.special import softmax
-from simpletransformers.classification import ClassificationModel, ClassificationArgs
-
-# instantiate models
+from .model_registry import ModelRegistry
+from .transform_cache import TransformCache
+
+# model files, the models and their libraries (fasttext, simpletransformers/torch, nltk) are
+# only imported and loaded when the pipelines run
 LOGREG_VECT = "modelling/saved_models/model_logreg_vectorizer.pkl"
 LOGREG_MODEL = "modelling/saved_models/model_logreg.pkl"
 SVM_VECT = "modelling/saved_models/model_SVM_vectorizer.pkl"
@@ -17,6 +17,8 @@ NB_MODEL = "modelling/saved_models/model_NB.pkl"
 RF_VECT = "modelling/saved_models/model_RF_vectorizer.pkl"
 RF_MODEL = "modelling/saved_models/model_RF.pkl"
 FASTTEXT_MODEL = "modelling/saved_models/model_fasttext.bin"
+# smaller quantized copy of the fasttext model, written by quantize_fasttext_model
+FASTTEXT_QUANTIZED_MODEL = "modelling/saved_models/model_fasttext.ftz"
 # the bert model has to be downloaded from a link I've shared on GDrive
 BERT_MODEL = "modelling/saved_models/model_bert"
 META_MODEL = "modelling/saved_models/model_meta.pkl"
@@ -29,100 +31,263 @@ def fasttext_get_index(lst, tag):
         if lst[i][-3:] == tag:
             return i
 
-def base_modelling_pipeline(processed_csv, prediction_csv):
+def load_pickle(path):
     '''
-    Reads processed data and outputs csv of predictions for each model
+    Loads a pickled model or vectorizer
     '''
-    # READ PROCESSED DATA
-    processed_df = pd.read_csv(processed_csv)
-    
-    # LOGISTIC REGRESSION PREDICTION
-    lr_vectorizer = pickle.load(open(LOGREG_VECT, "rb"))
-    lr_model = pickle.load(open(LOGREG_MODEL, "rb"))
-    lr_transformed_text = lr_vectorizer.transform(processed_df.phrase_stem_emoticon_unique)
-    lr_predictions = lr_model.predict_proba(lr_transformed_text)
-    processed_df["logreg_prob_pos"] = lr_predictions[:, 2]
-    processed_df["logreg_prob_neg"] = lr_predictions[:, 0]
-
-    # SUPPORT VECTOR MACHINE PREDICTION
-    svm_vectorizer = pickle.load(open(SVM_VECT, "rb"))
-    svm_model = pickle.load(open(SVM_MODEL, "rb"))
-    svm_transformed_text = svm_vectorizer.transform(processed_df.phrase_emoticon_generic)
-    svm_predictions = svm_model.predict_proba(svm_transformed_text)
-    processed_df["SVM_prob_pos"] = svm_predictions[:, 2]
-    processed_df["SVM_prob_neg"] = svm_predictions[:, 0]
-
-    # NAIVE BAYES PREDICTION
-    nb_vectorizer = pickle.load(open(NB_VECT, "rb"))
-    nb_model = pickle.load(open(NB_MODEL, "rb"))
-    nb_transformed_text = nb_vectorizer.transform(processed_df.phrase_stem_emoticon_generic)
-    nb_predictions = nb_model.predict_proba(nb_transformed_text)
-    processed_df["NB_prob_pos"] = nb_predictions[:, 2]
-    processed_df["NB_prob_neg"] = nb_predictions[:, 0]
-
-    # RANDOM FOREST PREDICTION
-    rf_vectorizer = pickle.load(open(RF_VECT, "rb"))
-    rf_model = pickle.load(open(RF_MODEL, "rb"))
-    rf_transformed_text = rf_vectorizer.transform(processed_df.phrase_stem_emoticon_generic)
-    rf_predictions = rf_model.predict_proba(rf_transformed_text)
-    processed_df["RF_prob_pos"] = rf_predictions[:, 2]
-    processed_df["RF_prob_neg"] = rf_predictions[:, 0]
-
-    print("LR, SVM, NB, RF predictions complete")
-
-    # FASTTEXT PREDICTION
-    fasttext_model = fasttext.load_model(FASTTEXT_MODEL)
-    fasttext_df = processed_df.copy()
-    # get raw output (('__label__pos', '__label__zer', '__label__neg'), array([0.74627936, 0.19218659, 0.06156404]))
-    fasttext_df['raw_output'] = fasttext_df.apply(lambda x: fasttext_model.predict(x['phrase_stem'].replace("\n", ""), k=-1), axis=1)
-    # get raw prob [0.74627936, 0.19218659, 0.06156404]
-    fasttext_df['raw_prob'] = fasttext_df.apply(lambda x: list(x.raw_output[1]), axis=1)
-    # get pos and neg index
-    fasttext_df['pos_index'] = fasttext_df.apply(lambda x: fasttext_get_index(list(x.raw_output[0]), 'pos'), axis=1)
-    fasttext_df['neg_index'] = fasttext_df.apply(lambda x: fasttext_get_index(list(x.raw_output[0]), 'neg'), axis=1)
-    # get prob_pos and prob_neg
-    fasttext_df['fasttext_prob_pos'] = fasttext_df.apply(lambda x: x.raw_prob[x.pos_index], axis=1)
-    fasttext_df['fasttext_prob_neg'] = fasttext_df.apply(lambda x: x.raw_prob[x.neg_index], axis=1)
-    # add to processed_df
-    processed_df["fasttext_prob_pos"] = fasttext_df['fasttext_prob_pos']
-    processed_df["fasttext_prob_neg"] = fasttext_df['fasttext_prob_neg']
+    with open(path, "rb") as f:
+        return pickle.load(f)
 
-    print("Fasttext predictions complete")
+def load_fasttext_model(quantized=False):
+    '''
+    Loads the fasttext model, or its quantized copy to use less memory
+    '''
+    import fasttext
+    return fasttext.load_model(FASTTEXT_QUANTIZED_MODEL if quantized else FASTTEXT_MODEL)
+
+def quantize_fasttext_model():
+    '''
+    Writes the quantized copy of the fasttext model to FASTTEXT_QUANTIZED_MODEL
+    '''
+    fasttext_model = load_fasttext_model()
+    fasttext_model.quantize()
+    fasttext_model.save_model(FASTTEXT_QUANTIZED_MODEL)
+
+def fasttext_predict_proba(fasttext_model, phrases):
+    '''
+    Predicts every phrase with a single fasttext call
+
+    Parameters:
+        fasttext_model (fasttext.FastText._FastText): supervised fasttext model
+        phrases (iterable): phrases to predict
 
-    # BERT PREDICTION
+    Return:
+        probabilities (np.ndarray): probability of each label per phrase, columns in get_labels() order
+    '''
+    label_index = {label: i for i, label in enumerate(fasttext_model.get_labels())}
+    all_labels, all_probs = fasttext_model.predict([phrase.replace("\n", "") for phrase in phrases], k=-1)
+    # labels of each phrase come sorted by probability, scatter them into label columns
+    counts = [len(labels) for labels in all_labels]
+    rows = np.repeat(np.arange(len(counts)), counts)
+    columns = np.array([label_index[label] for labels in all_labels for label in labels], dtype=np.int64)
+    probabilities = np.zeros((len(counts), len(label_index)))
+    if len(rows) > 0:
+        probabilities[rows, columns] = np.concatenate(all_probs)
+    return probabilities
+
+def load_bert_model():
+    '''
+    Loads the BERT model on cpu
+    '''
+    from simpletransformers.classification import ClassificationModel, ClassificationArgs
     bert_model_args = ClassificationArgs(num_train_epochs=2, learning_rate=5e-5)
-    bert_model = ClassificationModel(model_type = 'bert', \
-                                     model_name = BERT_MODEL, \
-                                     args = bert_model_args, use_cuda = False)
-    bert_pred, bert_raw_outputs = bert_model.predict(processed_df.phrase)
+    return ClassificationModel(model_type = 'bert', \
+                               model_name = BERT_MODEL, \
+                               args = bert_model_args, use_cuda = False)
+
+def default_registry(quantized_fasttext=False):
+    '''
+    Returns a ModelRegistry of every model used by the pipelines, each loaded on first use.
+    Pass the same registry to every pipeline call to keep the models loaded between batches.
+    quantized_fasttext loads FASTTEXT_QUANTIZED_MODEL, see quantize_fasttext_model
+    '''
+    return ModelRegistry({
+        "logreg_vectorizer": lambda: load_pickle(LOGREG_VECT),
+        "logreg": lambda: load_pickle(LOGREG_MODEL),
+        "SVM_vectorizer": lambda: load_pickle(SVM_VECT),
+        "SVM": lambda: load_pickle(SVM_MODEL),
+        "NB_vectorizer": lambda: load_pickle(NB_VECT),
+        "NB": lambda: load_pickle(NB_MODEL),
+        "RF_vectorizer": lambda: load_pickle(RF_VECT),
+        "RF": lambda: load_pickle(RF_MODEL),
+        "fasttext": lambda: load_fasttext_model(quantized_fasttext),
+        "bert": load_bert_model,
+        "VADER": load_VADER_analyser,
+        "meta": lambda: load_pickle(META_MODEL)
+    })
+
+# phrase column read by each base model, in the column order of the prediction csv
+MODEL_COLUMNS = {
+    "logreg": "phrase_stem_emoticon_unique",
+    "SVM": "phrase_emoticon_generic",
+    "NB": "phrase_stem_emoticon_generic",
+    "RF": "phrase_stem_emoticon_generic",
+    "fasttext": "phrase_stem",
+    "bert": "phrase",
+    "VADER": "phrase_emoticon_generic"
+}
+# sklearn models, each with a vectorizer registered as <model>_vectorizer
+SKLEARN_MODELS = ["logreg", "SVM", "NB", "RF"]
+# simpletransformers args that fork a multiprocessing.Pool in predict, turned off when the base
+# models run in parallel since forking a multithreaded process can deadlock
+BERT_MULTIPROCESSING_ARGS = ["use_multiprocessing", "use_multiprocessing_for_evaluation"]
+
+def factorize_phrases(phrases):
+    '''
+    Returns the index of each phrase in the unique phrases and the unique phrases, so a model
+    predicts every unique phrase once and its predictions are broadcast back with predictions[codes].
+    Missing phrases are kept as one unique phrase
+
+    Parameters:
+        phrases (pd.Series): phrases to factorize
+
+    Return:
+        codes (np.ndarray): position of each phrase in uniques
+        uniques (pd.Series): unique phrases in order of first appearance
+    '''
+    uniques = phrases.drop_duplicates().reset_index(drop=True)
+    codes = pd.Index(uniques).get_indexer(phrases)
+    return codes, uniques
+
+def sklearn_predict(registry, name, transform_cache):
+    '''
+    Returns the pos and neg probability columns of a sklearn model
+    '''
+    vectorizer = registry[name + "_vectorizer"]
+    model = registry[name]
+    predictions = model.predict_proba(transform_cache.transform(vectorizer, MODEL_COLUMNS[name]))
+    print("%s predictions complete" % name)
+    return {name + "_prob_pos": predictions[:, 2], name + "_prob_neg": predictions[:, 0]}
+
+def fasttext_predict(registry, phrases):
+    '''
+    Returns the pos and neg probability columns of the fasttext model
+    '''
+    fasttext_model = registry["fasttext"]
+    fasttext_predictions = fasttext_predict_proba(fasttext_model, phrases)
+    # get pos and neg index once from the model's labels ('__label__pos', '__label__zer', '__label__neg')
+    fasttext_labels = fasttext_model.get_labels()
+    print("Fasttext predictions complete")
+    return {"fasttext_prob_pos": fasttext_predictions[:, fasttext_get_index(fasttext_labels, 'pos')], \
+            "fasttext_prob_neg": fasttext_predictions[:, fasttext_get_index(fasttext_labels, 'neg')]}
+
+def bert_predict(registry, phrases):
+    '''
+    Returns the pos and neg probability columns of the BERT model
+    '''
+    from scipy.special import softmax
+    bert_model = registry["bert"]
+    bert_pred, bert_raw_outputs = bert_model.predict(phrases)
     # convert raw output to probabilities
     bert_probabilities = softmax(bert_raw_outputs, axis=1)
-    processed_df['bert_prob_pos'] = bert_probabilities[:, 1]
-    processed_df['bert_prob_neg'] = bert_probabilities[:, 2]
-
     print("BERT predictions complete")
-    
-    # VADER PREDICTION
-    processed_df[["VADER_prob_pos","VADER_prob_neg"]] = load_VADER_model(processed_df)
-    
+    return {"bert_prob_pos": bert_probabilities[:, 1], "bert_prob_neg": bert_probabilities[:, 2]}
+
+def vader_predict(registry, phrases):
+    '''
+    Returns the pos and neg probability columns of the VADER analyser
+    '''
+    vader_predictions = load_VADER_model(pd.DataFrame({"phrase_emoticon_generic": phrases}), registry["VADER"])
+    print("VADER predictions complete")
+    return {column: vader_predictions[column].to_numpy() for column in vader_predictions.columns}
+
+def split_cpu_budget(cpu_budget, n_workers):
+    '''
+    Splits cpu_budget cores between the base models run in parallel: every other worker keeps one
+    core, up to half the budget, and BERT's torch threads get the rest
+
+    Return:
+        bert_threads (int): number of torch threads for BERT
+    '''
+    return max(1, cpu_budget - min(n_workers - 1, cpu_budget // 2))
+
+def base_modelling_pipeline(processed_csv, prediction_csv, registry=None, parallel=False, cpu_budget=None):
+    '''
+    Reads processed data and outputs csv of predictions for each model. Models are taken from
+    registry, a new default_registry() if not given. Every model only predicts the unique phrases
+    of its column, the predictions are broadcast back to the rows
+
+    Parameters:
+        processed_csv (str): postprocessed phrases
+        prediction_csv (str): csv to write the phrases and predictions to
+        registry (ModelRegistry): registry holding the base models
+        parallel (bool): run the base models concurrently in a thread pool, each model only reads its
+            own phrase column and the heavy predictions (sklearn, torch) release the GIL. BERT's torch
+            threads and multiprocessing args are restored afterwards
+        cpu_budget (int): cores shared by the base models when parallel, defaults to os.cpu_count(),
+            see split_cpu_budget
+    '''
+    if registry is None:
+        registry = default_registry()
+
+    # READ PROCESSED DATA
+    processed_df = pd.read_csv(processed_csv)
+
+    # phrases repeat across reviews, factorize each phrase column once
+    codes, uniques = {}, {}
+    for column in dict.fromkeys(MODEL_COLUMNS.values()):
+        codes[column], uniques[column] = factorize_phrases(processed_df[column])
+        print("%s: %d phrases, %d unique (%.2fx dedupe)" % (column, len(processed_df), len(uniques[column]), \
+                                                          len(processed_df) / max(len(uniques[column]), 1)))
+    # identical vectorizers share their transform of a phrase column
+    transform_cache = TransformCache(uniques)
+
+    # load every model up front, so load times and memory in the registry report stay per model
+    for name in MODEL_COLUMNS:
+        if name in SKLEARN_MODELS:
+            registry.get(name + "_vectorizer")
+        registry.get(name)
+
+    tasks = {name: (sklearn_predict, (registry, name, transform_cache)) for name in SKLEARN_MODELS}
+    tasks["fasttext"] = (fasttext_predict, (registry, uniques[MODEL_COLUMNS["fasttext"]]))
+    tasks["bert"] = (bert_predict, (registry, uniques[MODEL_COLUMNS["bert"]]))
+    tasks["VADER"] = (vader_predict, (registry, uniques[MODEL_COLUMNS["VADER"]]))
+
+    start = time.perf_counter()
+    if parallel:
+        import torch
+        from concurrent.futures import ThreadPoolExecutor
+        cpu_budget = cpu_budget or os.cpu_count() or 1
+        n_workers = min(len(tasks), cpu_budget)
+        bert_args = registry["bert"].args
+        multiprocessing_args = {arg: getattr(bert_args, arg) for arg in BERT_MULTIPROCESSING_ARGS \
+                                if hasattr(bert_args, arg)}
+        # torch threads are process wide, put them back for later calls of a long-lived worker
+        torch_threads = torch.get_num_threads()
+        try:
+            torch.set_num_threads(split_cpu_budget(cpu_budget, n_workers))
+            for arg in multiprocessing_args:
+                setattr(bert_args, arg, False)
+            with ThreadPoolExecutor(max_workers=n_workers) as executor:
+                futures = {name: executor.submit(function, *args) for name, (function, args) in tasks.items()}
+                predictions = {name: future.result() for name, future in futures.items()}
+        finally:
+            torch.set_num_threads(torch_threads)
+            for arg, value in multiprocessing_args.items():
+                setattr(bert_args, arg, value)
+    else:
+        predictions = {name: function(*args) for name, (function, args) in tasks.items()}
+    print("Base model predictions took %.1fs" % (time.perf_counter() - start))
+    transform_cache.report()
+
+    # broadcast the predictions of the unique phrases back to the rows
+    for name, phrase_column in MODEL_COLUMNS.items():
+        for column, values in predictions[name].items():
+            processed_df[column] = np.asarray(values)[codes[phrase_column]]
+
     processed_df.to_csv(prediction_csv, index=False)
+    registry.report()
     print("BASELINE PREDICTIONS COMPLETE")
 
 
-def meta_modelling_pipeline(prediction_csv, ensemble_file):
+def meta_modelling_pipeline(prediction_csv, ensemble_file, registry=None):
     '''
     Retrieves predictions for each baseline model and outputs final prediction using meta model
 
     Parameters:
         prediction_dir (str): directory containing all predictions from baseline model
         ensemble_file (str):  filename to save ensemble predictions in
+        registry (ModelRegistry): registry holding the meta model, a new default_registry() if not given
     Return: none
     '''
+    if registry is None:
+        registry = default_registry()
+
     # read baseline model predictions 
     predictions_df = pd.read_csv(prediction_csv)
     
     # generate ensemble predictions
-    meta_model = pickle.load(open(META_MODEL, "rb"))
+    meta_model = registry["meta"]
 
     # fit model
     predictions = meta_model.predict_proba(predictions_df[['bert_prob_pos', 'bert_prob_neg', 'fasttext_prob_pos',
@@ -134,25 +299,52 @@ def meta_modelling_pipeline(prediction_csv, ensemble_file):
     predictions_df["prob_pos"] = 0
     predictions_df[["prob_neg","prob_neu","prob_pos"]] = predictions
     
-    ensemble_predictions = pd.DataFrame(data=predictions_df,columns=["restaurant_code", "review_title", "review_body", "review_title_raw", "review_body_raw", "review_date", "account_name", 
-        "account_id",  "account_level", "account_photo", "review_photo", "scraped_date", "location", "aspect", 
-        "prob_pos", "prob_neu", "prob_neg"]) 
+    ensemble_predictions = pd.DataFrame(data=predictions_df,columns=["review_id", "aspect", "prob_pos", "prob_neu", "prob_neg"]) 
     
     # save ensemble predictions
     ensemble_predictions.to_csv(ensemble_file, index=False)
     print("ENSEMBLE PREDICTIONS COMPLETE")
     
     
-def load_VADER_model(df):
+def load_VADER_model(df, sid=None):
     """
-    This function loads the VADER model whose dictionary has been updated.
+    This function predicts with the VADER model whose dictionary has been updated.
     
     Parameters:
         df(pd.DataFrame) : data to be predicted
+        sid(SentimentIntensityAnalyzer) : analyser from load_VADER_analyser, loaded if not given
     
     Return : dataframe with 2 columns containing prediction probability
        
     """
+    if sid is None:
+        sid = load_VADER_analyser()
+
+    # score each unique phrase once
+    codes, phrases = factorize_phrases(df.phrase_emoticon_generic)
+    dataframe = pd.DataFrame({"phrase_emoticon_generic": phrases})
+    dataframe["polarity_scores"] = dataframe.phrase_emoticon_generic.map(lambda phrase : sid.polarity_scores(phrase))
+    dataframe["pos"] = dataframe["polarity_scores"].map(lambda score_dict : score_dict["pos"])
+    dataframe["neg"] = dataframe["polarity_scores"].map(lambda score_dict : score_dict["neg"])
+
+    model_name = "VADER"
+    # Create Dataframe and output, broadcast back to every phrase
+    df = pd.DataFrame(data=dataframe[["neg","pos"]].values[codes], columns = [model_name+'_prob_neg', model_name+'_prob_pos'])
+    ordered_cols = [model_name+'_prob_pos',model_name+'_prob_neg']
+    df = df[ordered_cols]
+    
+    return df
+
+def load_VADER_analyser():
+    """
+    This function loads the VADER analyser and updates its dictionary with food review terms.
+    
+    Return : SentimentIntensityAnalyzer
+       
+    """
+    from nltk.sentiment.vader import SentimentIntensityAnalyzer
+    from utils.resources import ensure_nltk_data
+    ensure_nltk_data('sentiment/vader_lexicon.zip', 'vader_lexicon')
 
     sid = SentimentIntensityAnalyzer()
     
@@ -210,16 +402,4 @@ def load_VADER_model(df):
     sid.lexicon.update(new_price)
     sid.lexicon.update(new_portion)
 
-    dataframe = df.copy()
-    dataframe["polarity_scores"] = dataframe.phrase_emoticon_generic.map(lambda phrase : sid.polarity_scores(phrase))
-    dataframe["pos"] = dataframe["polarity_scores"].map(lambda score_dict : score_dict["pos"])
-    dataframe["neg"] = dataframe["polarity_scores"].map(lambda score_dict : score_dict["neg"])
-
-    model_name = "VADER"
-    # Create Dataframe and output
-    df = pd.DataFrame(data=dataframe[["neg","pos"]].values, columns = [model_name+'_prob_neg', model_name+'_prob_pos'])
-    ordered_cols = [model_name+'_prob_pos',model_name+'_prob_neg']
-    df = df[ordered_cols]
-    
-    return df
-
+    return sid
@@ -0,0 +1,56 @@
+import pickle
+import hashlib
+import threading
+import numpy as np
+
+def vectorizer_fingerprint(vectorizer):
+    '''
+    Returns a hash of everything that decides a fitted vectorizer's output: its class, parameters,
+    vocabulary and idf weights, so separately pickled but identical vectorizers share a fingerprint
+    '''
+    params = sorted((key, repr(value)) for key, value in vectorizer.get_params().items())
+    vocabulary = sorted(getattr(vectorizer, "vocabulary_", {}).items())
+    idf = getattr(vectorizer, "idf_", None)
+    state = (type(vectorizer).__module__, type(vectorizer).__name__, params, vocabulary, \
+             None if idf is None else np.asarray(idf).tobytes())
+    return hashlib.blake2b(pickle.dumps(state), digest_size=16).hexdigest()
+
+class TransformCache:
+    '''
+    Feature matrices of the sklearn base models for one batch, keyed by (vectorizer fingerprint,
+    text column) so identical vectorizers transform a column once. Matrices are float32 CSR. Safe to
+    share between threads, a matrix requested while it is being built waits for it
+
+    Parameters:
+        phrases (dict): phrase column -> phrases to transform, a DataFrame works too
+
+    Attributes:
+        transforms (int): matrices requested
+        deduplicated (int): requests answered by an earlier transform
+    '''
+    def __init__(self, phrases):
+        self.phrases = phrases
+        self.transforms = 0
+        self.deduplicated = 0
+        self._matrices = {}
+        self._lock = threading.Lock()
+        self._key_locks = {}
+
+    def transform(self, vectorizer, column):
+        '''
+        Returns vectorizer.transform of the column as a float32 CSR matrix
+        '''
+        key = (vectorizer_fingerprint(vectorizer), column)
+        with self._lock:
+            self.transforms += 1
+            key_lock = self._key_locks.setdefault(key, threading.Lock())
+        with key_lock:
+            if key in self._matrices:
+                with self._lock:
+                    self.deduplicated += 1
+            else:
+                self._matrices[key] = vectorizer.transform(self.phrases[column]).tocsr().astype(np.float32)
+            return self._matrices[key]
+
+    def report(self):
+        print("TRANSFORM CACHE: %d transforms, %d deduplicated" % (self.transforms, self.deduplicated))
@@ -2,3 +2,17 @@ from .postprocessing import *
 from .preprocessing import *
 from .rule_mining import *
 from .scoring import *
+from .token_table import *
+from .aspect_matcher import *
+from .pos_cache import *
+from .sqlite_store import *
+from .emoji_replacer import *
+
+def __getattr__(name):
+    # resources loaded on first use are not copied by the star imports above
+    for module in (postprocessing, rule_mining):
+        try:
+            return getattr(module, name)
+        except AttributeError:
+            pass
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
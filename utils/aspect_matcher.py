@@ -0,0 +1,104 @@
+import os
+import glob
+from collections import deque
+import pandas as pd
+
+ASPECT_DIR = "utils/aspects"
+
+class AspectMatcher :
+    '''
+    Aho-Corasick automaton over the aspect lexicons, finds every occurrence of every aspect term
+    in a text in a single pass
+
+    Attributes:
+        lexicons (dict): aspect label -> list of terms the automaton was built from
+    '''
+    def __init__(self, lexicons) :
+        self.lexicons = {label: list(terms) for label, terms in lexicons.items()}
+        # goto[state] maps a character to the next state, out[state] lists the
+        # (term length, label) of every term ending in that state
+        goto = [{}]
+        out = [[]]
+        for label, terms in self.lexicons.items() :
+            for term in terms :
+                if len(term) == 0 :
+                    continue
+                state = 0
+                for ch in term :
+                    next_state = goto[state].get(ch)
+                    if next_state is None :
+                        next_state = len(goto)
+                        goto[state][ch] = next_state
+                        goto.append({})
+                        out.append([])
+                    state = next_state
+                if (len(term), label) not in out[state] :
+                    out[state].append((len(term), label))
+
+        # failure links in breadth first order, so shallower states are always complete
+        fail = [0] * len(goto)
+        queue = deque(goto[0].values())
+        while queue :
+            state = queue.popleft()
+            for ch, next_state in goto[state].items() :
+                queue.append(next_state)
+                f = fail[state]
+                while f and ch not in goto[f] :
+                    f = fail[f]
+                fail[next_state] = goto[f].get(ch, 0)
+                out[next_state] = out[next_state] + out[fail[next_state]]
+
+        self._goto = goto
+        self._fail = fail
+        self._out = out
+
+    @classmethod
+    def from_csv_dir(cls, aspect_dir=ASPECT_DIR) :
+        '''
+        Builds the matcher from every <aspect>.csv in aspect_dir, each with a single <aspect> column
+        '''
+        lexicons = {}
+        for path in sorted(glob.glob(os.path.join(aspect_dir, "*.csv"))) :
+            label = os.path.splitext(os.path.basename(path))[0]
+            lexicons[label] = list(pd.read_csv(path)[label].astype(str))
+        return cls(lexicons)
+
+    def find(self, text) :
+        '''
+        Finds every aspect term in text, including overlapping ones
+
+        Parameters:
+            text (string): text to search
+
+        Returns:
+            hits (list): (start_char, end_char, label) of each occurrence, ordered by end_char
+        '''
+        goto, fail, out = self._goto, self._fail, self._out
+        hits = []
+        state = 0
+        for i, ch in enumerate(text) :
+            while state and ch not in goto[state] :
+                state = fail[state]
+            state = goto[state].get(ch, 0)
+            for length, label in out[state] :
+                hits.append((i + 1 - length, i + 1, label))
+        return hits
+
+    def match_tokens(self, tokens, hits) :
+        '''
+        Keeps the hits that start and end on token boundaries
+
+        Parameters:
+            tokens (TokenTable): tokens of the text hits were found in
+            hits (list): output of find
+
+        Returns:
+            token_hits (list): (label, start_token, end_token) of each hit, end_token exclusive
+        '''
+        starts = {start: i for i, start in enumerate(tokens.idx.tolist())}
+        ends = {end: i for i, end in enumerate(tokens.end_idx().tolist())}
+        token_hits = []
+        for start, end, label in hits :
+            if start in starts and end in ends :
+                token_hits.append((label, starts[start], ends[end] + 1))
+        return token_hits
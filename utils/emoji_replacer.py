@@ -0,0 +1,67 @@
+import re
+
+class EmojiReplacer :
+    '''
+    Replaces every emoji of a mapping in a single regex scan, with the same output as replacing each
+    emoji in mapping order with ' ' + mapping[emoji] + ' ' and collapsing whitespace (replace_emojis).
+
+    Emojis that overlap another emoji, e.g. a heart with and without its variation selector, depend
+    on the mapping order, so those few are still replaced one at a time in that order. If an emoji
+    could match text inserted by a replacement, the whole mapping is replaced one at a time
+
+    Attributes:
+        mapping (dict): emoji -> replacement text
+    '''
+    def __init__(self, mapping) :
+        self.mapping = dict(mapping)
+        keys = list(self.mapping)
+        inserted = set(" ".join(self.mapping.values())) | {" "}
+
+        # emojis that overlap another emoji: one contains the other, or one ends with the start of the other
+        prefixes = {}
+        for key in keys :
+            for i in range(1, len(key)) :
+                prefixes.setdefault(key[:i], set()).add(key)
+        key_set = set(keys)
+        ordered = set()
+        for key in keys :
+            for i in range(len(key)) :
+                for j in range(i + 1, len(key) + 1) :
+                    if key[i:j] != key and key[i:j] in key_set :
+                        ordered.update((key, key[i:j]))
+                if i > 0 and key[i:] in prefixes :
+                    owners = prefixes[key[i:]] - {key}
+                    if owners :
+                        ordered.add(key)
+                        ordered.update(owners)
+
+        self._sequential = any(len(key) == 0 or any(ch.isspace() or ch in inserted for ch in key) for key in keys)
+        if self._sequential :
+            ordered = key_set
+        self._ordered = [(key, " " + self.mapping[key] + " ") for key in keys if key in ordered]
+        single_pass = [key for key in keys if key not in ordered]
+        self._replacements = {key: " " + self.mapping[key] + " " for key in single_pass}
+        self._pattern = re.compile("|".join(re.escape(key) for key in single_pass)) if single_pass else None
+        # most phrases have no emojis, a single character class scan rules them out
+        characters = "".join(re.escape(ch) for ch in sorted(set("".join(keys))))
+        self._characters = re.compile("[%s]" % characters) if characters else None
+
+    def __call__(self, text) :
+        '''
+        Returns text with every emoji replaced and whitespace collapsed
+        '''
+        if self._sequential :
+            for key, replacement in self._ordered :
+                text = text.replace(key, replacement).strip()
+            return " ".join(text.split())
+        if self._characters is None or self._characters.search(text) is None :
+            return " ".join(text.split())
+        if self._pattern is not None :
+            replacements = self._replacements
+            text = self._pattern.sub(lambda match: replacements[match.group()], text)
+        if self._ordered :
+            text = text.strip()
+            for key, replacement in self._ordered :
+                if key in text :
+                    text = text.replace(key, replacement).strip()
+        return " ".join(text.split())
@@ -0,0 +1,98 @@
+import time
+import hashlib
+from .token_table import TokenTable
+from .sqlite_store import connect_sqlite, select_existing
+
+POS_CACHE_MAX_ENTRIES = 2000000
+POS_CACHE_COMMIT_EVERY = 1000
+
+class PosCache :
+    '''
+    On-disk cache of pos tagged reviews, keyed by a hash of the review text and the tagging model.
+    Entries are evicted least recently used first once there are more than max_entries
+
+    Attributes:
+        hits (int): lookups answered from the cache
+        misses (int): lookups that had to be tagged
+    '''
+    def __init__(self, path, namespace="", max_entries=POS_CACHE_MAX_ENTRIES) :
+        self.path = path
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self._conn = connect_sqlite(path)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS tokens (key BLOB PRIMARY KEY, tokens BLOB NOT NULL, "
+                           "last_used INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS tokens_last_used ON tokens (last_used)")
+        self._pending = 0
+        self._touched = []
+
+    def key(self, review) :
+        '''
+        Returns the cache key of review
+        '''
+        return hashlib.blake2b((self.namespace + "\0" + review).encode(), digest_size=16).digest()
+
+    def contains(self, reviews) :
+        '''
+        Returns a list of whether each review is cached, without counting hits or misses
+        '''
+        keys = [self.key(review) for review in reviews]
+        found = select_existing(self._conn, "tokens", "key", keys)
+        return [key in found for key in keys]
+
+    def get(self, review) :
+        '''
+        Returns the cached TokenTable of review, or None
+        '''
+        key = self.key(review)
+        row = self._conn.execute("SELECT tokens FROM tokens WHERE key = ?", (key,)).fetchone()
+        if row is None :
+            self.misses += 1
+            return None
+        self.hits += 1
+        self._touched.append((time.time_ns(), key))
+        self._tick()
+        return TokenTable.from_bytes(row[0], review)
+
+    def put(self, review, tokens) :
+        '''
+        Stores the TokenTable of review
+        '''
+        self._conn.execute("INSERT OR REPLACE INTO tokens (key, tokens, last_used) VALUES (?, ?, ?)", \
+                           (self.key(review), tokens.to_bytes(), time.time_ns()))
+        self._tick()
+
+    def _tick(self) :
+        self._pending += 1
+        if self._pending >= POS_CACHE_COMMIT_EVERY :
+            self.commit()
+
+    def commit(self) :
+        '''
+        Writes pending entries and access times to disk
+        '''
+        if self._touched :
+            self._conn.executemany("UPDATE tokens SET last_used = ? WHERE key = ?", self._touched)
+            self._touched = []
+        self._conn.commit()
+        self._pending = 0
+
+    def evict(self) :
+        '''
+        Deletes the least recently used entries above max_entries
+        '''
+        self.commit()
+        n_entries = self._conn.execute("SELECT COUNT(*) FROM tokens").fetchone()[0]
+        if n_entries > self.max_entries :
+            self._conn.execute("DELETE FROM tokens WHERE key IN (SELECT key FROM tokens ORDER BY last_used LIMIT ?)", \
+                               (n_entries - self.max_entries,))
+            self._conn.commit()
+
+    def close(self) :
+        '''
+        Evicts down to max_entries and closes the cache
+        '''
+        self.evict()
+        self._conn.close()
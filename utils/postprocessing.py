@@ -1,29 +1,90 @@
+import os
 import re
+import json
 import string
-import utils
 import numpy as np 
 import pandas as pd 
-from emot.emo_unicode import UNICODE_EMO, EMOTICONS
-from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
-import nltk
-from nltk.corpus import stopwords
-nltk.download('wordnet')
-from gensim.parsing.preprocessing import STOPWORDS
-from nltk.stem import WordNetLemmatizer, PorterStemmer 
-nltk.download('wordnet')
-
-STOPWORD_SET = list(STOPWORDS.union(set(stopwords.words("english"))))
+from functools import lru_cache
+from .resources import ensure_nltk_data, CACHE_DIR
+from .emoji_replacer import EmojiReplacer
+
 NEGATION_TERMS = ["not", "never", "no", "nothing", "neither", "nowhere", "doesn't", "doesn", "isn't", "isn", \
                   "wasn", "wasn't", "cant", "can't", "cannot", "shouldn't", "shouldn", "won", "won't", "couldn't", \
                   "couldn", "couldnt", "don", "don't"]
-STOPWORD_SET = set([word for word in STOPWORD_SET if word not in NEGATION_TERMS])
-
-WORD_TOKENIZER = nltk.WordPunctTokenizer()
-LEMMATIZER = WordNetLemmatizer()
-STEMMER = PorterStemmer()
 PUNCTUATION_TABLE = str.maketrans(dict.fromkeys(string.punctuation))
+EMOJI_MAPPING_CACHE = os.path.join(CACHE_DIR, "emoji_mappings.json")
+# review vocabulary is small next to the number of tokens, so lemmas and stems are memoized per word
+WORD_CACHE_SIZE = 2 ** 17
+
+# nltk, gensim and the emoji mappings are slow to load, so they are only loaded on first use
+@lru_cache(maxsize=None)
+def get_stopword_set():
+    from nltk.corpus import stopwords
+    from gensim.parsing.preprocessing import STOPWORDS
+    ensure_nltk_data('corpora/stopwords', 'stopwords')
+    stopword_set = list(STOPWORDS.union(set(stopwords.words("english"))))
+    return set([word for word in stopword_set if word not in NEGATION_TERMS])
+
+@lru_cache(maxsize=None)
+def get_word_tokenizer():
+    import nltk
+    return nltk.WordPunctTokenizer()
+
+@lru_cache(maxsize=None)
+def get_lemmatizer():
+    from nltk.stem import WordNetLemmatizer
+    ensure_nltk_data('corpora/wordnet', 'wordnet')
+    return WordNetLemmatizer()
+
+@lru_cache(maxsize=None)
+def get_stemmer():
+    from nltk.stem import PorterStemmer
+    return PorterStemmer()
+
+class WordCache:
+    '''
+    Bounded least recently used cache of a per word function, e.g. lemmatizing or stemming
+
+    Parameters:
+        func (function): word -> result, only called on cache misses
+        maxsize (int): number of words kept, None for unbounded
+    '''
+    def __init__(self, func, maxsize=WORD_CACHE_SIZE):
+        self.func = func
+        self.resize(maxsize)
+
+    def __call__(self, word):
+        return self._cached(word)
+
+    def resize(self, maxsize):
+        '''
+        Sets the number of words kept, clearing the cache and its counters
+        '''
+        self.maxsize = maxsize
+        self._cached = lru_cache(maxsize=maxsize)(self.func)
+
+    def cache_info(self):
+        '''
+        Returns the hits, misses, maxsize and currsize of the cache
+        '''
+        return self._cached.cache_info()
+
+    def cache_clear(self):
+        self._cached.cache_clear()
+
+# shared by every phrase variant, and by modelling/dataProcessingUtils.py
+LEMMA_CACHE = WordCache(lambda word: get_lemmatizer().lemmatize(word))
+STEM_CACHE = WordCache(lambda word: get_stemmer().stem(word))
+
+def set_word_cache_size(maxsize):
+    '''
+    Resizes the lemma and stem caches, clearing them
+    '''
+    LEMMA_CACHE.resize(maxsize)
+    STEM_CACHE.resize(maxsize)
 
 def get_emoji_sentiment_mapping(UNICODE_EMO, text_pos, text_neg):
+    from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
     analyser = SentimentIntensityAnalyzer()
     d = {}
     for k in UNICODE_EMO:
@@ -36,20 +97,62 @@ def get_emoji_sentiment_mapping(UNICODE_EMO, text_pos, text_neg):
             d[k] = text_neg
     return d
 
-EMOJI_GENERIC_MAPPING = get_emoji_sentiment_mapping(UNICODE_EMO, 'good', 'bad')
-EMOJI_UNIQUE_MAPPING = get_emoji_sentiment_mapping(UNICODE_EMO, 'emoji_good', 'emoji_bad')
+@lru_cache(maxsize=None)
+def get_emoji_mappings():
+    '''
+    Returns the generic and unique emoji sentiment mappings. They are built with VADER the first time
+    and saved to EMOJI_MAPPING_CACHE, delete the file to rebuild them
 
-def clean_phrase(phrase, remove_whitespace=True, remove_stopwords=True, remove_punctuation=True, remove_nonascii=True, \
-                 remove_single_characters=True, remove_numbers=True, lemmatize=False, stem=False, convert_emoji_generic=False, \
-                 convert_emoji_unique=False):
-    if convert_emoji_generic:
-        phrase = replace_emojis(phrase, EMOJI_GENERIC_MAPPING)
-    if convert_emoji_unique:
-        phrase = replace_emojis(phrase, EMOJI_UNIQUE_MAPPING)
+    Returns:
+        generic (dict): emoji -> good or bad
+        unique (dict): emoji -> emoji_good or emoji_bad
+    '''
+    if os.path.exists(EMOJI_MAPPING_CACHE):
+        with open(EMOJI_MAPPING_CACHE, encoding="utf-8") as f:
+            mappings = json.load(f)
+    else:
+        from emot.emo_unicode import UNICODE_EMO
+        mappings = {
+            "generic": get_emoji_sentiment_mapping(UNICODE_EMO, 'good', 'bad'),
+            "unique": get_emoji_sentiment_mapping(UNICODE_EMO, 'emoji_good', 'emoji_bad')
+        }
+        os.makedirs(CACHE_DIR, exist_ok=True)
+        with open(EMOJI_MAPPING_CACHE, "w", encoding="utf-8") as f:
+            json.dump(mappings, f, ensure_ascii=False)
+    return mappings["generic"], mappings["unique"]
+
+@lru_cache(maxsize=None)
+def get_emoji_replacers():
+    '''
+    Returns the EmojiReplacer of the generic and unique emoji mappings, compiled once
+    '''
+    generic, unique = get_emoji_mappings()
+    return EmojiReplacer(generic), EmojiReplacer(unique)
+
+LAZY_RESOURCES = {
+    "STOPWORD_SET": get_stopword_set,
+    "WORD_TOKENIZER": get_word_tokenizer,
+    "LEMMATIZER": get_lemmatizer,
+    "STEMMER": get_stemmer,
+    "EMOJI_GENERIC_MAPPING": lambda: get_emoji_mappings()[0],
+    "EMOJI_UNIQUE_MAPPING": lambda: get_emoji_mappings()[1]
+}
+
+def __getattr__(name):
+    if name in LAZY_RESOURCES:
+        return LAZY_RESOURCES[name]()
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+def filter_phrase(phrase, remove_whitespace=True, remove_stopwords=True, remove_punctuation=True, remove_nonascii=True, \
+                  remove_single_characters=True, remove_numbers=True):
+    '''
+    Runs the filtering steps of clean_phrase, everything before lemmatizing or stemming
+    '''
     if remove_whitespace:
         phrase = phrase.strip()
     if remove_stopwords:
-        phrase = " ".join([word for word in WORD_TOKENIZER.tokenize(phrase) if not word in STOPWORD_SET])
+        stopword_set = get_stopword_set()
+        phrase = " ".join([word for word in get_word_tokenizer().tokenize(phrase) if not word in stopword_set])
     if remove_punctuation:
         phrase = phrase.translate(PUNCTUATION_TABLE)
     if remove_nonascii:
@@ -58,45 +161,100 @@ def clean_phrase(phrase, remove_whitespace=True, remove_stopwords=True, remove_p
         phrase = " ".join([word for word in phrase.split() if len(word) > 1])
     if remove_numbers:
         phrase = "".join([i for i in phrase if not i.isdigit()])
+    return phrase
+
+def clean_phrase(phrase, remove_whitespace=True, remove_stopwords=True, remove_punctuation=True, remove_nonascii=True, \
+                 remove_single_characters=True, remove_numbers=True, lemmatize=False, stem=False, convert_emoji_generic=False, \
+                 convert_emoji_unique=False):
+    if convert_emoji_generic:
+        phrase = get_emoji_replacers()[0](phrase)
+    if convert_emoji_unique:
+        phrase = get_emoji_replacers()[1](phrase)
+    phrase = filter_phrase(phrase, remove_whitespace, remove_stopwords, remove_punctuation, remove_nonascii, \
+                           remove_single_characters, remove_numbers)
     if lemmatize:
-        phrase = " ".join([LEMMATIZER.lemmatize(word) for word in WORD_TOKENIZER.tokenize(phrase)])
+        phrase = " ".join([LEMMA_CACHE(word) for word in get_word_tokenizer().tokenize(phrase)])
     if stem:
-        phrase = " ".join([STEMMER.stem(word) for word in WORD_TOKENIZER.tokenize(phrase)])
+        phrase = " ".join([STEM_CACHE(word) for word in get_word_tokenizer().tokenize(phrase)])
         
     phrase = " ".join(phrase.split())
     return phrase.lower()
 
+# column -> clean_phrase arguments of each phrase variant produced by postprocessing_pipeline
+PHRASE_VARIANTS = {
+    "phrase_lemma": dict(lemmatize=True),
+    "phrase_stem": dict(stem=True),
+    "phrase_emoticon_generic": dict(convert_emoji_generic=True),
+    "phrase_lemma_emoticon_generic": dict(lemmatize=True, convert_emoji_generic=True),
+    "phrase_stem_emoticon_generic": dict(stem=True, convert_emoji_generic=True),
+    "phrase_emoticon_unique": dict(convert_emoji_unique=True),
+    "phrase_lemma_emoticon_unique": dict(lemmatize=True, convert_emoji_unique=True),
+    "phrase_stem_emoticon_unique": dict(stem=True, convert_emoji_unique=True),
+    "phrase": dict()
+}
+
+def clean_phrase_variants(phrase):
+    '''
+    Cleans phrase into every variant in PHRASE_VARIANTS, same output as calling clean_phrase once per variant.
+    Each emoji variant is filtered and tokenized once and shared by its plain, lemma and stem columns, and
+    emoji variants without any emoji reuse the plain filtered phrase
+
+    Parameters:
+        phrase (string): phrase to clean
+
+    Returns:
+        variants (dict): column -> cleaned phrase
+    '''
+    generic_replacer, unique_replacer = get_emoji_replacers()
+    tokenizer = get_word_tokenizer()
+
+    filtered = filter_phrase(phrase)
+    # emoji replacement always collapses whitespace, which does not change the filtered phrase
+    collapsed = " ".join(phrase.split())
+    variants = {}
+    for suffix, replacer in (("", None), ("_emoticon_generic", generic_replacer), ("_emoticon_unique", unique_replacer)):
+        base = filtered
+        if replacer is not None:
+            replaced = replacer(phrase)
+            if replaced != collapsed:
+                base = filter_phrase(replaced)
+        words = tokenizer.tokenize(base)
+        variants["phrase" + suffix] = " ".join(base.split()).lower()
+        variants["phrase_lemma" + suffix] = " ".join(" ".join([LEMMA_CACHE(word) for word in words]).split()).lower()
+        variants["phrase_stem" + suffix] = " ".join(" ".join([STEM_CACHE(word) for word in words]).split()).lower()
+    return variants
+
 def replace_emojis(text, mapping):
+    '''
+    Replaces each emoji of mapping in order, one pass per emoji. clean_phrase uses the equivalent
+    single pass EmojiReplacer instead
+    '''
     for emot in mapping:
         text = text.replace(emot, ' ' + mapping[emot] + ' ').strip()
     return " ".join(text.split())
 
 
-def postprocessing_pipeline(rule_mined_csv, postprocessed_csv):
+def postprocessing_pipeline(rule_mined_csv, postprocessed_csv, word_cache_size=None):
     '''
     Runs postprocessing on rule mined file
+
+    Lemmas and stems are memoized per word in LEMMA_CACHE and STEM_CACHE, word_cache_size resizes
+    them (None keeps the current size). Their hits and misses are printed to help size the caches
     '''
-    rule_mined_df = pd.read_csv(rule_mined_csv)
+    if word_cache_size is not None:
+        set_word_cache_size(word_cache_size)
+    rule_mined_df = pd.read_csv(rule_mined_csv, usecols=["review_id", "aspect", "phrase"])
 
-    # clean phrases
-    rule_mined_df["phrase_lemma"] = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=True, stem=False))
-    rule_mined_df["phrase_stem"] = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=False, stem=True))
-    rule_mined_df["phrase_emoticon_generic"] = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=False, stem=False, convert_emoji_generic = True))
-    rule_mined_df["phrase_lemma_emoticon_generic"] = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=True, stem=False, convert_emoji_generic = True))
-    rule_mined_df["phrase_stem_emoticon_generic"] = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=False, stem=True, convert_emoji_generic = True))
-    rule_mined_df["phrase_emoticon_unique"] = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=False, stem=False, convert_emoji_unique = True))
-    rule_mined_df["phrase_lemma_emoticon_unique"] = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=True, stem=False, convert_emoji_unique = True))
-    rule_mined_df["phrase_stem_emoticon_unique"] = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=False, stem=True, convert_emoji_unique = True))
-    rule_mined_df.phrase = rule_mined_df.phrase.apply(lambda x: clean_phrase(x, lemmatize=False, stem=False))
+    # clean phrases, each distinct phrase is cleaned once into all its variants
+    variants = {phrase: clean_phrase_variants(phrase) for phrase in rule_mined_df.phrase.unique()}
+    for column in PHRASE_VARIANTS:
+        rule_mined_df[column] = rule_mined_df.phrase.map({phrase: variant[column] for phrase, variant in variants.items()})
 
     # filter out rows where there are no characters
     rule_mined_df = rule_mined_df.loc[(rule_mined_df.phrase.str.len() > 0)]
 
-    # aggregate phrases
-    postprocessed_df = rule_mined_df.groupby(["restaurant_code", "review_title", "review_body", "review_date",\
-        "review_title_raw", "review_body_raw", "account_name", "account_id", "account_level", "account_photo", \
-        "review_photo", "scraped_date", "aspect"
-        ], as_index=False).agg({
+    # aggregate phrases by review and aspect
+    postprocessed_df = rule_mined_df.groupby(["review_id", "aspect"], sort=False, as_index=False).agg({
             "phrase": " ".join,
             "phrase_lemma":" ".join,
             "phrase_stem":" ".join,
@@ -107,7 +265,9 @@ def postprocessing_pipeline(rule_mined_csv, postprocessed_csv):
             "phrase_stem_emoticon_unique": " ".join,
             "phrase_lemma_emoticon_unique" : " ".join
         })
-    postprocessed_df = postprocessed_df.reset_index(drop=True)
 
     postprocessed_df.to_csv(postprocessed_csv, index=False)
+    for name, cache in (("LEMMA", LEMMA_CACHE), ("STEM", STEM_CACHE)):
+        info = cache.cache_info()
+        print("%s CACHE: %d hits, %d misses, %d/%s words" % (name, info.hits, info.misses, info.currsize, info.maxsize))
     print("POST-PROCESSING COMPLETE")
\ No newline at end of file
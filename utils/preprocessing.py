@@ -1,7 +1,18 @@
 import string
 from string import digits
+import numpy as np
 import pandas as pd 
 
+# scraped columns that identify a review, hashed into its review_id
+REVIEW_KEY_COLUMNS = ["restaurant_code", "review_title", "review_body", "review_date", "account_name", "account_id", \
+                      "account_level", "account_photo", "review_photo", "scraped_date"]
+# review columns of the preprocessed review table, joined back onto the ratings in reviews_final
+REVIEW_COLUMNS = ["restaurant_code", "review_title", "review_body", "review_title_raw", "review_body_raw", "review_date", \
+                  "account_name", "account_id", "account_level", "account_photo", "review_photo", "scraped_date"]
+# reviews read and written per chunk, so memory does not grow with the review history
+PREPROCESSING_CHUNK_SIZE = 50000
+DIGITS_TABLE = str.maketrans('', '', digits)
+
 def clean_review(review) : 
     '''
     Removes digits, empty strings, and new lines from phrases
@@ -13,31 +24,85 @@ def clean_review(review) :
         review (string): processed review texttext
     '''
     # remove numbers
-    remove_digits = str.maketrans('', '', digits)
-    review = review.translate(remove_digits)
+    review = review.translate(DIGITS_TABLE)
     # remove new lines
     review = review.replace('\n', ' ')
     return review
 
-def preprocessing_pipeline(review_file, preprocessed_csv):
+def clean_reviews(reviews) :
+    '''
+    Vectorized clean_review over a series of review texts
+
+    Parameters:
+        reviews (pd.Series): review texts
+
+    Output:
+        reviews (pd.Series): processed review texts
+    '''
+    return reviews.str.translate(DIGITS_TABLE).str.replace('\n', ' ', regex=False)
+
+def get_review_ids(review_df) :
+    '''
+    Returns a stable integer id per review, hashed from its REVIEW_KEY_COLUMNS so identical reviews
+    share an id. Later stages group and join on it instead of the review text
+
+    Parameters:
+        review_df (pd.DataFrame): scraped reviews
+
+    Output:
+        review_ids (np.ndarray): int64 id of each review
     '''
-    Runs preprocessing on review_file
+    hashes = pd.util.hash_pandas_object(review_df[REVIEW_KEY_COLUMNS].astype(str), index=False)
+    return hashes.to_numpy().view(np.int64)
+
+def preprocess_reviews(review_df, seen_ids=None) :
     '''
-    # read review_df
-    review_df = pd.read_csv(review_file)
+    Preprocesses a chunk of scraped reviews
 
+    Parameters:
+        review_df (pd.DataFrame): scraped reviews
+        seen_ids (set): review_ids of earlier chunks, reviews already seen are dropped and the
+            new review_ids are added
+
+    Output:
+        review_df (pd.DataFrame): review table rows of the chunk
+    '''
     # convert any np.nans to empty string
     review_df = review_df.fillna("") 
 
+    # id reviews before their text is cleaned, the preprocessed file is the review table of the
+    # pipeline so it keeps one row per review
+    review_df.insert(0, "review_id", get_review_ids(review_df))
+    review_df = review_df.drop_duplicates("review_id")
+    if seen_ids is not None :
+        review_df = review_df.loc[~review_df["review_id"].isin(seen_ids)]
+        seen_ids.update(review_df["review_id"].tolist())
+
     # keep original raw
     review_df["review_title_raw"] = review_df["review_title"]
     review_df["review_body_raw"] = review_df["review_body"]
 
     # clean review text
-    review_df["review_title"] = review_df["review_title"].apply(lambda x: clean_review(x))
-    review_df["review_body"] = review_df["review_body"].apply(lambda x: clean_review(x))
+    review_df["review_title"] = clean_reviews(review_df["review_title"])
+    review_df["review_body"] = clean_reviews(review_df["review_body"])
+    return review_df
+
+def preprocessing_pipeline(review_file, preprocessed_csv, chunksize=PREPROCESSING_CHUNK_SIZE):
+    '''
+    Runs preprocessing on review_file, streaming it in chunks of chunksize reviews (None reads
+    the whole file at once). Columns are read as text so every chunk hashes the same review_ids
+    '''
+    if chunksize is None :
+        chunks = [pd.read_csv(review_file, dtype=str)]
+    else :
+        chunks = pd.read_csv(review_file, dtype=str, chunksize=chunksize)
 
-    # save preprocessed file
-    review_df.to_csv(preprocessed_csv, index=False)
+    seen_ids = set()
+    header = True
+    for chunk in chunks :
+        review_df = preprocess_reviews(chunk, seen_ids)
+        # save preprocessed chunk
+        review_df.to_csv(preprocessed_csv, index=False, header=header, mode="w" if header else "a")
+        header = False
     
-    print("PRE-PROCESSING COMPLETE")
\ No newline at end of file
+    print("PRE-PROCESSING COMPLETE")
@@ -0,0 +1,16 @@
+# generated resources (e.g. the emoji mappings) are cached here, relative to the root directory
+CACHE_DIR = "utils/cache"
+
+def ensure_nltk_data(resource, package) :
+    '''
+    Downloads an nltk package if resource is not installed yet, so nothing is downloaded at import time
+
+    Parameters:
+        resource (string): nltk.data path of the resource, e.g. corpora/stopwords
+        package (string): nltk package providing it, e.g. stopwords
+    '''
+    import nltk
+    try :
+        nltk.data.find(resource)
+    except LookupError :
+        nltk.download(package)
@@ -4,324 +4,364 @@ import pandas as pd
 import numpy as np
 import ast
 import os
-import en_core_web_sm
-import re
-import nltk
-from nltk.corpus import stopwords
-from nltk.tokenize import word_tokenize  
-import string
-from string import digits
-
-nlp = en_core_web_sm.load()
-nltk.download('punkt')
-
-FOOD_LIST = list(pd.read_csv("utils/aspects/food.csv")['food'].astype(str))
-TIME_LIST = list(pd.read_csv("utils/aspects/time.csv")['time'].astype(str))
-PRICE_LIST = list(pd.read_csv("utils/aspects/price.csv")['price'].astype(str))
-PORTION_LIST = list(pd.read_csv("utils/aspects/portion.csv")['portion'].astype(str))
-SERVICE_LIST = list(pd.read_csv("utils/aspects/service.csv")['service'].astype(str))
-AMBIENCE_LIST = list(pd.read_csv("utils/aspects/ambience.csv")['ambience'].astype(str))
-
-
-def get_all_aspects(df):
-    '''
-    description: get the unique synonyms for each aspect 
-    input: dataframe
-    output: dataframe (saved as csv)
-    '''
-    food = []
-    time = []
-    price = []
-    portion = []
-    service = []
-    ambience = []
-    for row in range(0, len(df)) :
-        # turn each aspects string into dictionary
-        row_aspects_dict = ast.literal_eval(df['aspects'][row])
-        # get the aspect keys
-        row_aspects_keys = list(row_aspects_dict.keys())
-        for key in row_aspects_keys :
-            if key == 'food' :
-                for value in row_aspects_dict['food'] :
-                    if value not in food :
-                        food.append(str(value))
-            elif key == 'time' :
-                for value in row_aspects_dict['time'] :
-                    if value not in time :
-                        time.append(str(value))
-            elif key == 'price' :
-                for value in row_aspects_dict['price'] :
-                    if value not in price :
-                        price.append(str(value))
-            elif key == 'portion' :
-                for value in row_aspects_dict['portion'] :
-                    if value not in portion :
-                        portion.append(str(value))
-            elif key == 'service' :
-                for value in row_aspects_dict['service'] :
-                    if value not in service :
-                        service.append(str(value))
-            elif key == 'ambience' :
-                for value in row_aspects_dict['ambience'] :
-                    if value not in ambience :
-                        ambience.append(str(value))
-        print(row, "out of", len(df), "done")
-    # create dataframe
-    food_df = pd.DataFrame({'food': food})
-    time_df = pd.DataFrame({'time': time})
-    price_df = pd.DataFrame({'price': price})
-    portion_df = pd.DataFrame({'portion': portion})
-    service_df = pd.DataFrame({'service': service})
-    ambience_df = pd.DataFrame({'ambience': ambience})
-    print("dataframes created")
+from functools import lru_cache
+from .token_table import TokenTable, token_runs
+from .aspect_matcher import AspectMatcher, ASPECT_DIR
+from .pos_cache import PosCache
+
+# the rules only read token text, pos and tag, so the parser, ner and lemmatizer are not run
+SPACY_DISABLED_PIPES = ["parser", "ner", "lemmatizer"]
+SPACY_BATCH_SIZE = 256
+
+ASPECTS = ["food", "time", "price", "portion", "service", "ambience"]
+ASPECT_LIST_NAMES = {"FOOD_LIST": "food", "TIME_LIST": "time", "PRICE_LIST": "price", "PORTION_LIST": "portion", \
+                     "SERVICE_LIST": "service", "AMBIENCE_LIST": "ambience"}
+
+@lru_cache(maxsize=None)
+def get_nlp() :
+    '''
+    description: load the spacy model on first use
+    output: spacy language
+    '''
+    import en_core_web_sm
+    return en_core_web_sm.load(disable=SPACY_DISABLED_PIPES)
+
+def get_pos_cache_namespace() :
+    '''
+    description: cached pos tags are only reused by the same model and pipes
+    output: str
+    '''
+    meta = get_nlp().meta
+    return "%s_%s-%s:%s" % (meta["lang"], meta["name"], meta["version"], ",".join(SPACY_DISABLED_PIPES))
+
+@lru_cache(maxsize=None)
+def get_aspect_matcher() :
+    '''
+    description: build the aspect matcher from the lexicons on first use
+    output: AspectMatcher
+    '''
+    return AspectMatcher.from_csv_dir(ASPECT_DIR)
+
+def __getattr__(name) :
+    # nlp, ASPECT_MATCHER and the aspect lists are loaded on first access
+    if name == "nlp" :
+        return get_nlp()
+    if name == "ASPECT_MATCHER" :
+        return get_aspect_matcher()
+    if name in ASPECT_LIST_NAMES :
+        return get_aspect_matcher().lexicons[ASPECT_LIST_NAMES[name]]
+    raise AttributeError("module %r has no attribute %r" % (__name__, name))
+
+
+ASPECT_CHUNK_SIZE = 100000
+
+def get_all_aspects(labelled, aspect_dir='./aspects', chunksize=ASPECT_CHUNK_SIZE):
+    '''
+    description: get the unique synonyms for each aspect. labelled is a dataframe or the path of a csv,
+        with an 'aspects' column of dictionary strings. csvs are streamed in chunks of chunksize rows
+    input: dataframe or str, str, int
+    output: none (saved as <aspect>.csv in aspect_dir)
+    '''
+    # dicts keep insertion order, so they work as ordered sets
+    synonyms = {aspect: {} for aspect in ASPECTS}
+    chunks = pd.read_csv(labelled, usecols=['aspects'], chunksize=chunksize) if isinstance(labelled, str) else [labelled]
+    n_rows = 0
+    for chunk in chunks :
+        for row_aspects in chunk['aspects'] :
+            # turn each aspects string into dictionary
+            for key, values in ast.literal_eval(row_aspects).items() :
+                if key in synonyms :
+                    synonyms[key].update(dict.fromkeys([str(value) for value in values]))
+        n_rows += len(chunk)
+        print(n_rows, "rows done")
     # create new folder
-    if not os.path.exists('./aspects') :
-        os.makedirs('./aspects')
+    if not os.path.exists(aspect_dir) :
+        os.makedirs(aspect_dir)
     # save as csv
-    food_df.to_csv("./aspects/food.csv", index=False)
-    time_df.to_csv("./aspects/time.csv", index=False)
-    price_df.to_csv("./aspects/price.csv", index=False)
-    portion_df.to_csv("./aspects/portion.csv", index=False)
-    service_df.to_csv("./aspects/service.csv", index=False)
-    ambience_df.to_csv("./aspects/ambience.csv", index=False)
+    for aspect in ASPECTS :
+        pd.DataFrame({aspect: list(synonyms[aspect])}).to_csv(os.path.join(aspect_dir, aspect + ".csv"), index=False)
     print("dataframes saved")
 
-def get_pos(review) :
+def get_pos(review, cache=None) :
     '''
-    description: get the text, pos and tag of each word
-    input: text
-    output: dataframe
+    description: get the text, pos and tag of each word, from cache (a PosCache) if it has the review
+    input: text, PosCache
+    output: TokenTable
     '''
-    text = []
-    pos = []
-    tag = []
-    doc = nlp(review)
-    for token in doc:
-        text.append(token.text)
-        pos.append(token.pos_)
-        tag.append(token.tag_)
-    pos_df = pd.DataFrame({'text': text, 'pos': pos, 'tag': tag})
-    return pos_df
+    if cache is not None :
+        tokens = cache.get(review)
+        if tokens is None :
+            tokens = TokenTable.from_doc(get_nlp()(review))
+            cache.put(review, tokens)
+        return tokens
+    return TokenTable.from_doc(get_nlp()(review))
 
-def get_aspects(review, pos_df, aspect_list):
+def get_pos_batch(reviews, batch_size=SPACY_BATCH_SIZE, n_process=1, cache=None) :
     '''
-    description: get aspects
-    input: string, list
-    output: list, list
+    description: get the text, pos and tag of each word for many reviews, parsed in batches
+        with nlp.pipe. n_process=-1 uses every cpu on the machine. with a cache (a PosCache), only
+        reviews that are not cached yet are parsed, and they are added to the cache
+    input: iterable of text, int, int, PosCache
+    output: generator of TokenTable, in the same order as reviews
     '''
-    # get aspects present in review
-    aspects = list(pos_df.loc[pos_df['text'].isin(aspect_list)]['text'])
-    # get sentences with aspects
-    aspect_sentences = []
-    # split into sentences
-    sentences = review.split('.')
-    for i in range(0, len(sentences)) :
-        if any(aspect in sentences[i] for aspect in aspect_list) :
-            aspect_sentences.append(sentences[i])
-    return aspects, aspect_sentences
-
-def ranges(nums):
-    '''
-    description: get the ranges
-    input: list
+    if n_process == -1 :
+        n_process = os.cpu_count() or 1
+    if cache is None :
+        for doc in get_nlp().pipe(reviews, batch_size=batch_size, n_process=n_process) :
+            yield TokenTable.from_doc(doc)
+        return
+
+    reviews = list(reviews)
+    # parse each uncached review once, in order of first appearance
+    missing = dict.fromkeys([review for review, cached in zip(reviews, cache.contains(reviews)) if not cached])
+    docs = get_nlp().pipe(list(missing), batch_size=batch_size, n_process=n_process)
+    for review in reviews :
+        if review in missing :
+            tokens = TokenTable.from_doc(next(docs))
+            cache.put(review, tokens)
+            cache.misses += 1
+            del missing[review]
+            yield tokens
+        else :
+            yield cache.get(review)
+
+def get_aspects(review, tokens, aspect, hits=None):
+    '''
+    description: get the tokens of review that are terms of aspect. hits are the ASPECT_MATCHER hits for
+        review, found here if not given
+    input: string, TokenTable, str, list
     output: list
     '''
-    nums = sorted(set(nums))
-    gaps = [[s, e] for s, e in zip(nums, nums[1:]) if s+1 < e]
-    edges = iter(nums[:1] + sum(gaps, []) + nums[-1:])
-    return list(zip(edges, edges))
+    matcher = get_aspect_matcher()
+    if hits is None :
+        hits = matcher.find(review)
+    # get aspects present in review
+    aspects = [tokens.text[start] for label, start, end in matcher.match_tokens(tokens, hits) \
+               if label == aspect and end - start == 1]
+    return aspects
 
-def pos_before_after_aspect(pos_df, aspect_list, target_pos) :
+def get_pos_windows(tokens, target_pos) :
     '''
-    description: get the text where first word is target_pos and last word is aspect and vice versa
-    input: dataframe, list, str
-    output: list
+    description: prefix scan for the start of the window opened before each token, which is the last
+        target_pos or verb token before it (one token earlier after an adv or det), and the positions of the
+        target_pos tokens that can close a window after an aspect. computed once per review and shared by
+        every aspect
+    input: TokenTable, str
+    output: array, array
     '''
-    start, end = 0, 0
-    sentences = []
-    positions_start = []
-    positions_end = []
-    filtered = []
-    aspect_index = list(pos_df.loc[pos_df['text'].isin(aspect_list)].index)
-    
-    # adjectives before
-    for i in range(0, len(aspect_index)) :
-        index = aspect_index[i]
-        for j in reversed(range(0, index)) :
-            if pos_df['pos'][j] == target_pos or pos_df['pos'][j] == 'VERB':
-                # check if there is an adv or det before then add that
-                if j>1 :
-                    if pos_df['pos'][j-1] == 'ADV' or pos_df['pos'][j-1] == 'DET' :
-                        positions_start.append(j-1)
-                        positions_end.append(index+1)
-                    else :
-                        positions_start.append(j)
-                        positions_end.append(index+1)
-                else :
-                    positions_start.append(j)
-                    positions_end.append(index+1)  
-
-    # adjectives after
-    for i in range(0, len(aspect_index)) :
-        index = aspect_index[i]
-        for j in range(index, len(pos_df)) :
-            if pos_df['pos'][j] == target_pos :
-                positions_start.append(index+1)
-                positions_end.append(j)
-            
-    positions_df = pd.DataFrame({'start': positions_start, 'end': positions_end})
-    positions_df = positions_df.drop_duplicates().reset_index(drop=True)
-    positions_df = positions_df.sort_values(by=['start', 'end'])
-    filtered_df_1 = positions_df.drop_duplicates(subset=['end'], keep='last').reset_index(drop=True)
-    filtered_df = filtered_df_1.drop_duplicates(subset=['start'], keep='last').reset_index(drop=True)
-    
-    for i in range(0, len(filtered_df)) :
-        start = filtered_df['start'][i]
-        end = filtered_df['end'][i]
-        if start < end and start!=0 and end!=0:
-            review = pos_df['text'][start:end+1].apply(lambda x:x + ' ').sum()
-            if '.' in review :
-                review = review.split(".")[0]
-            elif '!' in review :
-                review = review.split("!")[0]
-            elif '?' in review :
-                review = review.split("?")[0]
-            if len(review) > 0 :
-                filtered.append(review)
-    return filtered
-
-def get_sentence_indexes(sentence, pos_df) :
-    '''
-    description: get the start and end indexes of the sentence
-    input: string, dataframe
-    output: dataframe
+    n = len(tokens)
+    before = tokens.pos_mask(target_pos, 'VERB')
+    extend = np.zeros(n, dtype=bool)
+    extend[2:] = tokens.pos_mask('ADV', 'DET')[1:-1]
+    positions = np.arange(n)
+    before_start = np.where(before, np.where(extend, positions - 1, positions), -1)
+    # starts only move forward, so the running max is the start from the last adjective or verb
+    prev_start = np.full(n, -1, dtype=np.int64)
+    if n > 1 :
+        prev_start[1:] = np.maximum.accumulate(before_start[:-1])
+    after = np.flatnonzero(tokens.pos_mask(target_pos))
+    return prev_start, after
+
+def aspect_windows(aspect_index, windows) :
+    '''
+    description: get the (start, end) token windows around the aspect positions, keeping the latest
+        start for each end and then the latest end for each start. linear in the number of tokens
+    input: sorted array, output of get_pos_windows
+    output: array of shape (n, 2), sorted by start
     '''
-    sentence_split = sentence.split(" ")
-    target_pos = pos_df.loc[pos_df['text'].isin(sentence_split)]
-    target_index = list(target_pos.index)
-    ranges_list = ranges(target_index)
-    for i in ranges_list :
-        if i[0] != i[1] :
-            start = i[0]
-            end = i[1] + 1
-            return pos_df[start:end]
-
-def get_sentences_indexes(sentence, pos_df) :
-    all_indexes = pd.DataFrame({'text':[], 'pos':[],'tag':[]})
-    for i in range(0, len(sentence)) :
-        pos_df_target = get_sentence_indexes(sentence[i], pos_df)
-        all_indexes = pd.concat([all_indexes, pos_df_target])
-    return all_indexes
-        
-def get_sentences(pos_df, pos_df_original) :
-    '''
-    description: get the sentences from indexes
-    input: dataframe, dataframe
+    prev_start, after = windows
+    n = len(prev_start)
+    # windows ending on the token after an aspect, from the last adjective or verb before it
+    starts = prev_start[aspect_index]
+    has_before = starts >= 0
+    before_start, before_end = starts[has_before], aspect_index[has_before] + 1
+    # windows ending on an adjective, from the token after the last aspect at or before it
+    last_aspect = np.searchsorted(aspect_index, after, side='right') - 1
+    has_aspect = last_aspect >= 0
+    after_start, after_end = aspect_index[last_aspect[has_aspect]] + 1, after[has_aspect]
+
+    # latest start for each end
+    latest_start = np.full(n + 1, -1, dtype=np.int64)
+    np.maximum.at(latest_start, np.concatenate([before_end, after_end]), np.concatenate([before_start, after_start]))
+    ends = np.flatnonzero(latest_start >= 0)
+    # latest end for each remaining start
+    latest_end = np.full(n + 1, -1, dtype=np.int64)
+    np.maximum.at(latest_end, latest_start[ends], ends)
+    starts = np.flatnonzero(latest_end >= 0)
+    return np.stack([starts, latest_end[starts]], axis=1)
+
+SENTENCE_BOUNDARIES = ['.', '!', '?']
+
+def window_words(tokens, start, end) :
+    '''
+    description: get the words of the window from token start to end (inclusive), cut before the first
+        '.' (or else '!', or else '?') as if the window text were split on it, without building the text
+    input: TokenTable, int, int
+    output: set, or None if nothing is left before the cut
+    '''
+    text = tokens.text[start:end+1].tolist()
+    for boundary in SENTENCE_BOUNDARIES :
+        cut = next((k for k, t in enumerate(text) if boundary in t), None)
+        if cut is not None :
+            head = text[cut][:text[cut].index(boundary)]
+            if cut == 0 and len(head) == 0 :
+                return None
+            text = text[:cut] + [head]
+            break
+    return set([word for t in text for word in t.split(" ")])
+
+def get_word_run(words, tokens) :
+    '''
+    description: get the first run of at least two consecutive tokens whose text is one of words
+    input: iterable, TokenTable
+    output: (start, end) token span with end exclusive, or None
+    '''
+    word_positions = tokens.word_positions()
+    target_index = sorted([j for word in set(words) for j in word_positions.get(word, ())])
+    for start, end in token_runs(target_index) :
+        if start != end :
+            return start, end + 1
+
+def drop_duplicate_tokens(positions, tokens) :
+    '''
+    description: sort positions and keep only the first position of each distinct (text, pos, tag) token
+    input: array, TokenTable
+    output: array
+    '''
+    positions = np.sort(positions)
+    first = np.unique(tokens.key_ids()[positions], return_index=True)[1]
+    return positions[np.sort(first)]
+
+def get_spans(positions) :
+    '''
+    description: get the (start, end) token spans, end exclusive, of the runs of at least two positions
+    input: array
     output: list
     '''
-    pos_df_phrases = []
-    pos_df_index = list(pos_df.index)
-    ranges_list = ranges(pos_df_index)
-    for i in ranges_list :
-        if i[0] != i[1] :
-            start = i[0]
-            end = i[1] + 1
-            pos_df_phrases.append(pos_df_original['text'][start:end].apply(lambda x:x + ' ').sum())
-    return pos_df_phrases
+    return [(start, end + 1) for start, end in token_runs(np.unique(positions)) if start != end]
+
+def window_spans(tokens, aspect_index, windows) :
+    '''
+    description: get the phrase spans around the aspect positions
+    input: TokenTable, array, output of get_pos_windows
+    output: list of (start, end) token spans, end exclusive
+    '''
+    if len(aspect_index) == 0 :
+        return []
+    aspect_pos = [np.empty(0, dtype=np.int64)]
+    for start, end in aspect_windows(aspect_index, windows).tolist() :
+        if start < end and start!=0 and end!=0:
+            words = window_words(tokens, start, end)
+            run = get_word_run(words, tokens) if words is not None else None
+            if run is not None :
+                aspect_pos.append(np.arange(*run))
+    aspect_pos = drop_duplicate_tokens(np.concatenate(aspect_pos), tokens)
+    return get_spans(aspect_pos)
 
-def process_review_aspect(review, pos_df, aspect_list) :
+def process_review_aspect(review, tokens, aspect, hits=None) :
     '''
     description: apply functions to aspect
-    input: str, dataframe, list
+    input: str, TokenTable, str, list
     output: list
     '''
-    aspects, sentence = get_aspects(review, pos_df, aspect_list)
-    sentence_new = pos_before_after_aspect(pos_df, aspects, 'ADJ')
-    aspect_pos = get_sentences_indexes(sentence_new, pos_df)
-    aspect_pos = aspect_pos.sort_index().drop_duplicates()
-    phrase_list = get_sentences(aspect_pos, pos_df)
-    return phrase_list
+    aspects = get_aspects(review, tokens, aspect, hits)
+    aspect_index = np.flatnonzero(tokens.text_mask(aspects))
+    spans = window_spans(tokens, aspect_index, get_pos_windows(tokens, 'ADJ'))
+    return [tokens.join(start, end) for start, end in spans]
+
+def tag_aspect_tokens(tokens, hits, aspects=ASPECTS) :
+    '''
+    description: get the positions of the tokens that are a term of each aspect
+    input: TokenTable, list, list
+    output: dict of aspect -> sorted array of positions
+    '''
+    aspect_positions = {aspect: set() for aspect in aspects}
+    for label, start, end in get_aspect_matcher().match_tokens(tokens, hits) :
+        if end - start == 1 and label in aspect_positions :
+            aspect_positions[label].add(start)
+    return {aspect: np.array(sorted(positions), dtype=np.int64) for aspect, positions in aspect_positions.items()}
+
+def extract_aspect_spans(review, tokens, aspects=ASPECTS, hits=None) :
+    '''
+    description: get the phrase spans of every aspect in a single pass over the review. aspect terms are
+        found once for all aspects and the pos windows are shared, so the cost of an aspect only depends
+        on how often it is mentioned
+    input: str, TokenTable, list, list
+    output: dict of aspect -> list of (start, end) token spans, end exclusive
+    '''
+    if hits is None :
+        hits = get_aspect_matcher().find(review)
+    aspect_index = tag_aspect_tokens(tokens, hits, aspects)
+    windows = get_pos_windows(tokens, 'ADJ')
+    return {aspect: window_spans(tokens, aspect_index[aspect], windows) for aspect in aspects}
 
-def add_phrases(df, all_aspects) :
+def extract_aspect_phrases(review, tokens, aspects=ASPECTS, hits=None) :
     '''
-    description: add phrase_no_noun and phrase_no_aspect
-    input: dataframe, list
+    description: get the phrases of every aspect, see extract_aspect_spans
+    input: str, TokenTable, list, list
+    output: dict of aspect -> list of phrases
+    '''
+    aspect_spans = extract_aspect_spans(review, tokens, aspects, hits)
+    return {aspect: [tokens.join(start, end) for start, end in spans] for aspect, spans in aspect_spans.items()}
+
+def add_phrases(df, all_aspects, cache=None, batch_size=SPACY_BATCH_SIZE, n_process=1) :
+    '''
+    description: add phrase_no_noun and phrase_no_aspect. each distinct phrase is pos tagged once, in
+        batches with nlp.pipe and through cache (a PosCache) if given
+    input: dataframe, list, PosCache, int, int
     output: dataframe
     '''
-    new_phrase_no_aspect = []
-    new_phrase_no_noun = []
-    for i in range(0, len(df)) :
-        no_aspect = []
-        no_noun = []
-        phrase_list = df['phrase'][i].split(', ')
-        for phrase in phrase_list:
-            if phrase not in all_aspects :
-                no_aspect.append(phrase)
-            if get_pos(phrase)['pos'][0] != 'NOUN' :
-                no_noun.append(phrase)
-        new_phrase_no_aspect.append(no_aspect)
-        new_phrase_no_noun.append(no_noun)
-    df['phrase_no_aspect'] = new_phrase_no_aspect
-    df['phrase_no_noun'] = new_phrase_no_noun
+    phrase_lists = [phrases.split(', ') for phrases in df['phrase']]
+    unique_phrases = list(dict.fromkeys([phrase for phrase_list in phrase_lists for phrase in phrase_list]))
+    token_tables = get_pos_batch(unique_phrases, batch_size=batch_size, n_process=n_process, cache=cache)
+    noun_phrases = set([phrase for phrase, tokens in zip(unique_phrases, token_tables) \
+                        if len(tokens) > 0 and tokens.pos_tag(0) == 'NOUN'])
+    all_aspects = set(all_aspects)
+    df['phrase_no_aspect'] = [[phrase for phrase in phrase_list if phrase not in all_aspects] for phrase_list in phrase_lists]
+    df['phrase_no_noun'] = [[phrase for phrase in phrase_list if phrase not in noun_phrases] for phrase_list in phrase_lists]
     return df
 
 
-def generate_phrase_list(row, phrase, aspect):
+def generate_phrase_list(row, phrase, aspect, phrase_start, phrase_end):
     return {
-        "restaurant_code": row["restaurant_code"],
-        "review_title": row["review_title"],
-        "review_body": row["review_body"],
-        "review_title_raw": row["review_title_raw"],
-        "review_body_raw": row["review_body_raw"], 
-        "review_date": row["review_date"],
-        "account_name": row["account_name"],
-        "account_id": row["account_id"],
-        "account_level": row["account_level"],
-        "account_photo": row["account_photo"],
-        "review_photo": row["review_photo"],
-        "scraped_date": row["scraped_date"],
+        "review_id": row["review_id"],
         "aspect": aspect,
-        "phrase": phrase
+        "phrase": phrase,
+        "phrase_start": phrase_start,
+        "phrase_end": phrase_end
     }
 
-def rule_mining_pipeline(preprocessed_csv, rule_mined_csv) :
+def rule_mining_pipeline(preprocessed_csv, rule_mined_csv, batch_size=SPACY_BATCH_SIZE, n_process=1, pos_cache=None) :
     '''
     Reads preprocessed csv and outputs new csv with reviews split into aspects
+
+    Reviews are pos tagged in batches of batch_size across n_process worker processes
+    (n_process=-1 uses every cpu). If pos_cache is the path of a PosCache database, only reviews
+    missing from it are tagged. phrase_start and phrase_end are the character offsets of each
+    phrase in the lowercased "review_title review_body" text. Only review_id identifies the review
+    of each phrase, the other review columns stay in the preprocessed review table
     '''
-    df = pd.read_csv(preprocessed_csv)
+    df = pd.read_csv(preprocessed_csv, usecols=["review_id", "review_title", "review_body"])
     df = df.fillna("")
     
-    food_phrases, time_phrases, price_phrases, portion_phrases, service_phrases, ambience_phrases = [], [], [], [], [], []
-    aspect_list, phrase_list, restaurant_code, review_title, review_body, account_name, account_id = [], [], [], [], [], [], []
-    
+    cache = PosCache(pos_cache, get_pos_cache_namespace()) if pos_cache is not None else None
+    reviews = (df["review_title"] + " " + df["review_body"]).str.lower()
+    token_tables = get_pos_batch(reviews, batch_size=batch_size, n_process=n_process, cache=cache)
+
     phrases_data_list = []
-    for i, row in df.iterrows():
-        review = (row["review_title"] + " " + row["review_body"]).lower()
-        
-        # for pre-processing
-        pos_df = get_pos(review)
-        
+    for (i, row), review, tokens in zip(df.iterrows(), reviews, token_tables):
         # get phrases for each aspect
-        food_phrases = process_review_aspect(review, pos_df, FOOD_LIST) 
-        time_phrases = process_review_aspect(review, pos_df, TIME_LIST)
-        price_phrases = process_review_aspect(review, pos_df, PRICE_LIST)
-        portion_phrases = process_review_aspect(review, pos_df, PORTION_LIST)
-        service_phrases = process_review_aspect(review, pos_df, SERVICE_LIST)
-        ambience_phrases = process_review_aspect(review, pos_df, AMBIENCE_LIST)
-
-        for phrase in food_phrases:
-            phrases_data_list.append(generate_phrase_list(row, phrase, "food"))
-        for phrase in time_phrases:
-            phrases_data_list.append(generate_phrase_list(row, phrase, "time"))
-        for phrase in price_phrases:
-            phrases_data_list.append(generate_phrase_list(row, phrase, "price"))
-        for phrase in portion_phrases:
-            phrases_data_list.append(generate_phrase_list(row, phrase, "portion"))
-        for phrase in service_phrases:
-            phrases_data_list.append(generate_phrase_list(row, phrase, "service"))
-        for phrase in ambience_phrases:
-            phrases_data_list.append(generate_phrase_list(row, phrase, "ambience"))
+        aspect_spans = extract_aspect_spans(review, tokens)
+        token_ends = tokens.end_idx()
+        for aspect in ASPECTS:
+            for start, end in aspect_spans[aspect]:
+                phrase = tokens.join(start, end)
+                phrases_data_list.append(generate_phrase_list(row, phrase, aspect, tokens.idx[start], token_ends[end-1]))
     
+    if cache is not None :
+        print("POS CACHE: %d hits, %d misses" % (cache.hits, cache.misses))
+        cache.close()
+
     # create df
     output = pd.DataFrame(phrases_data_list)
 
@@ -332,7 +372,7 @@ def rule_mining_pipeline(preprocessed_csv, rule_mined_csv) :
     output['phrase'] = output['phrase'].apply(lambda x: "".join(x))
 
     # remove duplicated rows
-    output = output.drop_duplicates().reset_index(drop=True)
+    output = output.drop_duplicates(subset=output.columns.drop(["phrase_start", "phrase_end"])).reset_index(drop=True)
     
     # save as csv
     output.to_csv(rule_mined_csv, index=False)
@@ -1,6 +1,14 @@
 import pandas as pd
 import numpy as np
-from datetime import datetime
+from .preprocessing import REVIEW_COLUMNS
+from .sqlite_store import connect_sqlite, select_existing
+
+# aspects rated in reviews_final, in column order. aspects outside this list get columns after them
+SCORING_ASPECTS = ["food", "service", "price", "ambience", "portion", "time"]
+# smallest review age in half years, so reviews from the last few days do not get infinite weight
+MIN_HALF_YEARS = 0.1
+# half life of review weights in the incremental restaurant scores of RestaurantScoreStore
+SCORE_HALF_LIFE_DAYS = 182
 
 def compute_score(prob_pos, prob_neu, prob_neg):
     '''
@@ -19,82 +27,279 @@ def compute_score(prob_pos, prob_neu, prob_neg):
     else:
         return round(3.0 + prob_pos * 2 - prob_neg * 0.2, 2)
 
+def compute_scores(prob_pos, prob_neu, prob_neg):
+    '''
+    Vectorized compute_score over arrays of probabilities
+    Parameters:
+        prob_pos (np.ndarray) : Probabilities of positive reviews
+        prob_neu (np.ndarray) : Probabilities of neutral reviews
+        prob_neg (np.ndarray) : Probabilities of negative reviews
+
+    Returns:
+        scores (np.ndarray) : Aggregated scores to 2 decimal place
+    '''
+    prob_pos = np.asarray(prob_pos, dtype=np.float64)
+    prob_neu = np.asarray(prob_neu, dtype=np.float64)
+    prob_neg = np.asarray(prob_neg, dtype=np.float64)
+    # neutral whenever prob_neu is a maximum, including ties (argmax would pick prob_pos on a tie)
+    neutral = (prob_neu >= prob_pos) & (prob_neu >= prob_neg)
+    raw = 3.0 + prob_pos * 2 - prob_neg * 0.2
+    # the pipeline passed np.float64 values to compute_score, where round() is np.round
+    scores = np.round(raw, 2)
+    return np.where(neutral, 3.0, scores)
+
 def score_reviews(df):
-    scores = []
-    for i, row in df.iterrows():
-        scores.append(compute_score(row["prob_pos"], row["prob_neu"], row["prob_neg"]))
-    df["rating"] = scores
+    df["rating"] = compute_scores(df["prob_pos"], df["prob_neu"], df["prob_neg"])
     return df
 
-def aggregate_reviews(df):
-    # split reviews by column
-    food, service, price, portion, ambience, time = [], [], [], [], [], []
-    for i, row in df.iterrows():
-        food.append(row["rating"] if row["aspect"] == "food" else 0)
-        service.append(row["rating"] if row["aspect"] == "service" else 0)
-        price.append(row["rating"] if row["aspect"] == "price" else 0)
-        ambience.append(row["rating"] if row["aspect"] == "ambience" else 0)
-        portion.append(row["rating"] if row["aspect"] == "portion" else 0)
-        time.append(row["rating"] if row["aspect"] == "time" else 0)
-    df["review_rating_food"] = food
-    df["review_rating_service"] = service
-    df["review_rating_price"] = price
-    df["review_rating_ambience"] = ambience
-    df["review_rating_portion"] = portion
-    df["review_rating_time"] = time
-
-    # aggregate ratings
-    aggregated_df = df.groupby(["restaurant_code", "review_title", "review_body", "review_title_raw", "review_body_raw", "review_date",\
-        "account_name", "account_id", "account_level", "account_photo", "review_photo", "scraped_date"], 
-        as_index=False)["review_rating_food", "review_rating_service", "review_rating_price", "review_rating_ambience",\
-            "review_rating_portion", "review_rating_time"].sum()
-
-    aggregated_df = aggregated_df.replace(0, np.nan)
-    overall = aggregated_df.loc[: , "review_rating_food":"review_rating_time"].mean(axis=1, skipna=True)
-    aggregated_df["review_rating_overall"] = overall
-
-    return aggregated_df
-
-def aggregate_restaurants(reviews_df):
-    df = reviews_df.copy()
-    # weight reviews by date of review
-    df['date'] = df.apply(lambda x: datetime.strptime(str(x.review_date), '%d/%m/%Y'), axis=1)
-    df['half_years'] = df.apply(lambda x: round((datetime.today() - x.date).days/182, 1), axis=1)
-    # define aspects
-    aspects_list = ['overall', 'food', 'service', 'price', 'ambience', 'portion', 'time']
-    # group by restaurant
-    restaurant_groups = df.groupby(by=['restaurant_code'])
-    aggregated_df = pd.DataFrame()
-    for restaurant, restaurant_df in restaurant_groups:
-        # store restaurant scores in a dictionary
-        restaurant_scores = dict()
-        restaurant_scores['restaurant_code'] = restaurant
-
-        # calculate average scores weighted by review date
-        for aspect in aspects_list:
-            aspect_df = pd.DataFrame(restaurant_df[[f'review_rating_{aspect}', 'half_years']])
-            # drop na
-            aspect_df = aspect_df.dropna()
-            if len(aspect_df) > 0:
-                restaurant_scores[f'review_rating_{aspect}'] = np.average(aspect_df[f'review_rating_{aspect}'], weights=1/aspect_df['half_years'])
-            else:
-                restaurant_scores[f'review_rating_{aspect}'] = np.nan
-        aggregated_df = aggregated_df.append(restaurant_scores, ignore_index=True)
-    return aggregated_df
-
-def scoring_pipeline(ensemble_csv, restaurant_csv, review_final_csv, restaurant_final_csv):
+def aggregate_reviews(df, review_df):
+    '''
+    Aggregates the aspect ratings of each review and joins them onto the review table
+
+    Parameters:
+        df (pd.DataFrame): scored phrases, one row per review_id and aspect
+        review_df (pd.DataFrame): review table, one row per review_id with its REVIEW_COLUMNS
+
+    Returns:
+        aggregated_df (pd.DataFrame): review columns, a review_rating_<aspect> column per aspect
+            (NaN where the review does not mention it) and their mean, review_rating_overall
+    '''
+    # spread ratings into a column per aspect, aspects missing from a review are left NaN
+    ratings_df = df.groupby(["review_id", "aspect"], sort=False)["rating"].sum(min_count=1).unstack("aspect")
+    aspects = SCORING_ASPECTS + sorted(set(ratings_df.columns) - set(SCORING_ASPECTS))
+    ratings_df = ratings_df.reindex(columns=aspects).add_prefix("review_rating_")
+    ratings_df.columns.name = None
+    ratings_df["review_rating_overall"] = ratings_df.mean(axis=1, skipna=True)
+
+    # join the review columns on review_id
+    aggregated_df = review_df[["review_id"] + REVIEW_COLUMNS].merge(ratings_df, left_on="review_id", right_index=True)
+    return aggregated_df.reset_index(drop=True)
+
+def get_half_years(review_dates, today=None):
+    '''
+    Returns the age of each review in half years (182 days) to 1 decimal place, used to weight reviews
+    by recency. Reviews from the last half week would round to 0, so ages are at least MIN_HALF_YEARS
+
+    Parameters:
+        review_dates (pd.Series): review dates as dd/mm/yyyy strings
+        today (pd.Timestamp): date ages are measured from, defaults to today
+
+    Returns:
+        half_years (pd.Series): age of each review
+    '''
+    today = pd.Timestamp.today() if today is None else today
+    dates = pd.to_datetime(review_dates.astype(str), format='%d/%m/%Y')
+    return ((today - dates).dt.days / 182).round(1).clip(lower=MIN_HALF_YEARS)
+
+def get_rating_columns(columns):
+    '''
+    Returns the review_rating_<aspect> columns among columns, in restaurants_final order: overall,
+    then SCORING_ASPECTS (always included), then any other aspect
+    '''
+    standard = ["review_rating_overall"] + ["review_rating_" + aspect for aspect in SCORING_ASPECTS]
+    others = sorted(set(column for column in columns if column.startswith("review_rating_")) - set(standard))
+    return standard + others
+
+def weighted_rating_sums(reviews_df, weights):
+    '''
+    Returns the weighted rating sum and weight sum of every rated (restaurant, aspect)
+
+    Parameters:
+        reviews_df (pd.DataFrame): aggregated reviews with restaurant_code and review_rating_<aspect> columns
+        weights (pd.Series): weight of each review
+
+    Returns:
+        sums_df (pd.DataFrame): restaurant_code, aspect (its rating column), weighted_rating and weight
+    '''
+    rating_columns = [column for column in get_rating_columns(reviews_df.columns) if column in reviews_df.columns]
+    df = reviews_df[["restaurant_code"] + rating_columns].copy()
+    df["weight"] = np.asarray(weights, dtype=np.float64)
+
+    ratings_df = df.melt(id_vars=["restaurant_code", "weight"], value_vars=rating_columns, \
+                         var_name="aspect", value_name="rating").dropna(subset=["rating"])
+    ratings_df["weighted_rating"] = ratings_df["rating"] * ratings_df["weight"]
+    return ratings_df.groupby(["restaurant_code", "aspect"], as_index=False).agg(weighted_rating=("weighted_rating", "sum"), \
+                                                                                weight=("weight", "sum"))
+
+def sums_to_ratings(sums_df, restaurant_codes=None):
+    '''
+    Returns the weighted average ratings of weighted_rating_sums, one row per restaurant
+
+    Parameters:
+        sums_df (pd.DataFrame): restaurant_code, aspect, weighted_rating and weight
+        restaurant_codes (iterable): restaurants to include even without ratings, defaults to those in sums_df
+
+    Returns:
+        aggregated_df (pd.DataFrame): restaurant_code and review_rating_<aspect> columns, NaN for
+            aspects none of its reviews rated
+    '''
+    sums_df = sums_df.set_index(["restaurant_code", "aspect"])
+    aggregated_df = (sums_df["weighted_rating"] / sums_df["weight"]).unstack("aspect")
+    if restaurant_codes is None:
+        restaurant_codes = aggregated_df.index
+    aggregated_df = aggregated_df.reindex(index=np.sort(pd.unique(pd.Series(restaurant_codes).dropna())), \
+                                          columns=get_rating_columns(aggregated_df.columns))
+    aggregated_df.columns.name = None
+    return aggregated_df.rename_axis("restaurant_code").reset_index()
+
+def aggregate_restaurants(reviews_df, today=None):
+    '''
+    Averages the review ratings of each restaurant, weighting each review by 1 / its age in half years
+
+    Parameters:
+        reviews_df (pd.DataFrame): aggregated reviews with restaurant_code, review_date and
+            review_rating_<aspect> columns
+        today (pd.Timestamp): date review ages are measured from, defaults to today
+
+    Returns:
+        aggregated_df (pd.DataFrame): restaurant_code and weighted review_rating_<aspect> of each
+            restaurant, NaN for aspects none of its reviews rated
+    '''
+    sums_df = weighted_rating_sums(reviews_df, 1 / get_half_years(reviews_df["review_date"], today))
+    return sums_to_ratings(sums_df, reviews_df["restaurant_code"])
+
+def get_decay_weights(review_dates, reference_date, half_life_days=SCORE_HALF_LIFE_DAYS):
+    '''
+    Returns the exponential decay weight of each review at reference_date, which halves every
+    half_life_days of review age
+
+    Parameters:
+        review_dates (pd.Series): review dates as dd/mm/yyyy strings
+        reference_date (pd.Timestamp): date review ages are measured from
+        half_life_days (float): age at which a review counts half as much as a new one
+
+    Returns:
+        weights (pd.Series): weight of each review
+    '''
+    dates = pd.to_datetime(review_dates.astype(str), format='%d/%m/%Y')
+    return 0.5 ** ((reference_date - dates).dt.days / half_life_days)
+
+class RestaurantScoreStore:
+    '''
+    On-disk running sums of exponentially decayed review ratings per (restaurant, aspect), so a batch
+    of new reviews is added without revisiting old ones. Every sum is kept at reference_date: rolling
+    forward multiplies all of them by the same decay factor, so averages do not change and old
+    reviews never need reweighting. Reviews are only added once, tracked by review_id: a review's
+    rating is fixed once it is added, reviews whose ratings change (e.g. re-scored by a new model)
+    need the store rebuilt with scoring_pipeline(full_recompute=True)
+
+    Attributes:
+        half_life_days (float): half life of the review weights
+        reference_date (pd.Timestamp): date the sums are decayed to, None while the store is empty
+    '''
+    def __init__(self, path, half_life_days=SCORE_HALF_LIFE_DAYS, reset=False):
+        self.path = path
+        self._conn = connect_sqlite(path)
+        if reset:
+            self._conn.executescript("DROP TABLE IF EXISTS sums; DROP TABLE IF EXISTS reviews; DROP TABLE IF EXISTS meta;")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS sums (restaurant_code TEXT NOT NULL, aspect TEXT NOT NULL, "
+                           "weighted_rating REAL NOT NULL, weight REAL NOT NULL, PRIMARY KEY (restaurant_code, aspect))")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS reviews (review_id INTEGER PRIMARY KEY)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        meta = dict(self._conn.execute("SELECT key, value FROM meta"))
+        if "half_life_days" in meta and float(meta["half_life_days"]) != half_life_days:
+            raise ValueError("%s was built with a half life of %s days, rebuild it with reset=True" % \
+                             (path, meta["half_life_days"]))
+        self.half_life_days = half_life_days
+        self.reference_date = pd.Timestamp(meta["reference_date"]) if "reference_date" in meta else None
+        self._set_meta("half_life_days", half_life_days)
+        self._conn.commit()
+
+    def _set_meta(self, key, value):
+        self._conn.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?)", (key, str(value)))
+
+    def roll_forward(self, date):
+        '''
+        Decays every sum to date, nothing happens if date is not after reference_date
+        '''
+        date = pd.Timestamp(date).normalize()
+        if self.reference_date is not None and date <= self.reference_date:
+            return
+        if self.reference_date is not None:
+            factor = 0.5 ** ((date - self.reference_date).days / self.half_life_days)
+            self._conn.execute("UPDATE sums SET weighted_rating = weighted_rating * ?, weight = weight * ?", (factor, factor))
+        self.reference_date = date
+        self._set_meta("reference_date", date.isoformat())
+        self._conn.commit()
+
+    def new_reviews(self, reviews_df):
+        '''
+        Returns the reviews of reviews_df that have not been added yet, only the batch's review_ids
+        are looked up
+        '''
+        review_ids = reviews_df["review_id"].drop_duplicates().tolist()
+        added = select_existing(self._conn, "reviews", "review_id", review_ids)
+        return reviews_df.loc[~reviews_df["review_id"].isin(added)]
+
+    def add_reviews(self, reviews_df, today=None):
+        '''
+        Rolls the sums forward to today and adds the ratings of reviews not added before
+
+        Parameters:
+            reviews_df (pd.DataFrame): aggregated reviews with review_id, restaurant_code, review_date
+                and review_rating_<aspect> columns
+            today (pd.Timestamp): date to roll forward to, defaults to today
+
+        Returns:
+            n_added (int): number of reviews added
+        '''
+        self.roll_forward(pd.Timestamp.today() if today is None else today)
+        new_df = self.new_reviews(reviews_df).drop_duplicates("review_id")
+        if len(new_df) == 0:
+            return 0
+        weights = get_decay_weights(new_df["review_date"], self.reference_date, self.half_life_days)
+        sums_df = weighted_rating_sums(new_df, weights)
+        self._conn.executemany("INSERT INTO sums (restaurant_code, aspect, weighted_rating, weight) VALUES (?, ?, ?, ?) "
+                               "ON CONFLICT (restaurant_code, aspect) DO UPDATE SET "
+                               "weighted_rating = weighted_rating + excluded.weighted_rating, weight = weight + excluded.weight", \
+                               sums_df[["restaurant_code", "aspect", "weighted_rating", "weight"]].itertuples(index=False))
+        self._conn.executemany("INSERT OR IGNORE INTO reviews (review_id) VALUES (?)", \
+                               ((review_id,) for review_id in new_df["review_id"].tolist()))
+        self._conn.commit()
+        return len(new_df)
+
+    def ratings(self):
+        '''
+        Returns the decayed average ratings of every restaurant, as aggregate_restaurants does
+        '''
+        sums_df = pd.read_sql("SELECT restaurant_code, aspect, weighted_rating, weight FROM sums", self._conn)
+        return sums_to_ratings(sums_df)
+
+    def close(self):
+        self._conn.close()
+
+def scoring_pipeline(ensemble_csv, review_csv, restaurant_csv, review_final_csv, restaurant_final_csv, \
+                     score_store=None, full_recompute=False, half_life_days=SCORE_HALF_LIFE_DAYS):
+    '''
+    Scores the ensemble predictions, review_csv is the preprocessed review table whose columns are
+    joined onto the review ratings in review_final_csv
+
+    Without a score_store, restaurants are scored from every review weighted by 1 / its age in half
+    years. If score_store is the path of a RestaurantScoreStore, restaurants are scored with
+    exponentially decayed weights (half_life_days) kept in the store, and only reviews not in the
+    store yet are added. Ratings of reviews already in the store are not updated, full_recompute
+    rebuilds the store from every review, e.g. after re-scoring or to verify it
+    '''
     ensemble_df = pd.read_csv(ensemble_csv)
 
     # score each aspect
     scored_reviews_df = score_reviews(ensemble_df)
     
     # aggregate scoring
-    aggregated_reviews_df = aggregate_reviews(scored_reviews_df)
+    review_df = pd.read_csv(review_csv)
+    aggregated_reviews_df = aggregate_reviews(scored_reviews_df, review_df)
     aggregated_reviews_df.to_csv(review_final_csv, index=False)
 
     # aggregate scoring for restaurants
     restaurant_orig_df = pd.read_csv(restaurant_csv)
-    aggregated_restaurants_df = aggregate_restaurants(aggregated_reviews_df)
+    if score_store is None:
+        aggregated_restaurants_df = aggregate_restaurants(aggregated_reviews_df)
+    else:
+        store = RestaurantScoreStore(score_store, half_life_days, reset=full_recompute)
+        n_added = store.add_reviews(aggregated_reviews_df)
+        print("SCORE STORE: %d new reviews added" % n_added)
+        aggregated_restaurants_df = store.ratings()
+        store.close()
     aggregated_restaurants_df = aggregated_restaurants_df.merge(restaurant_orig_df, on=['restaurant_code'])
     aggregated_restaurants_df = pd.DataFrame(aggregated_restaurants_df, columns=["restaurant_code", "restaurant_id", "restaurant_name", "location", 
         "lat",  "long", "price_per_pax", "categories", "restaurant_description", "restaurant_operating_hours", 
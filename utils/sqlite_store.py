@@ -0,0 +1,31 @@
+import os
+import sqlite3
+
+# values bound in one "IN (?, ...)" lookup, below sqlite's default limit of 999 parameters
+SQLITE_IN_CHUNK_SIZE = 500
+
+def connect_sqlite(path):
+    '''
+    Opens the sqlite database at path, creating its directory if needed
+    '''
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    return sqlite3.connect(path)
+
+def select_existing(conn, table, column, values, chunk_size=SQLITE_IN_CHUNK_SIZE):
+    '''
+    Returns the set of values found in column of table, looked up chunk_size values per query
+
+    Parameters:
+        conn (sqlite3.Connection): database connection
+        table (str): table to look in
+        column (str): column to match values against
+        values (list): values to look up
+    '''
+    found = set()
+    for i in range(0, len(values), chunk_size):
+        chunk = values[i:i + chunk_size]
+        query = "SELECT %s FROM %s WHERE %s IN (%s)" % (column, table, column, ",".join("?" * len(chunk)))
+        found.update(row[0] for row in conn.execute(query, chunk))
+    return found
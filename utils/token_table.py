@@ -0,0 +1,149 @@
+import numpy as np
+import pandas as pd
+
+# universal pos tags in spacy's symbol order, the index of a tag is its code
+POS_TAGS = ("", "ADJ", "ADP", "ADV", "AUX", "CONJ", "CCONJ", "DET", "INTJ", "NOUN", "NUM", "PART", "PRON", \
+            "PROPN", "PUNCT", "SCONJ", "SYM", "VERB", "X", "EOL", "SPACE")
+POS_CODES = {pos: code for code, pos in enumerate(POS_TAGS)}
+
+class TokenTable :
+    '''
+    Compact token representation of a tagged review, used by the rule engine in place of a
+    per-review pandas dataframe
+
+    Attributes:
+        text (np.ndarray): token text, object array
+        pos (np.ndarray): token pos as int8 codes into POS_TAGS
+        tag (np.ndarray): token fine-grained tag, object array
+        idx (np.ndarray): character offset of each token in the review
+    '''
+    __slots__ = ("text", "pos", "tag", "idx", "_word_positions", "_key_ids")
+
+    def __init__(self, text, pos, tag, idx) :
+        self.text = np.array(text, dtype=object)
+        self.pos = np.array([POS_CODES[p] for p in pos], dtype=np.int8)
+        self.tag = np.array(tag, dtype=object)
+        self.idx = np.array(idx, dtype=np.int64)
+        self._word_positions = None
+        self._key_ids = None
+
+    @classmethod
+    def from_doc(cls, doc) :
+        '''
+        Builds the table from a spacy doc
+        '''
+        return cls([token.text for token in doc], [token.pos_ for token in doc], [token.tag_ for token in doc], \
+                   [token.idx for token in doc])
+
+    @classmethod
+    def from_bytes(cls, data, review) :
+        '''
+        Rebuilds a table serialized with to_bytes, token text is sliced back out of review
+        '''
+        n = int(np.frombuffer(data, dtype=np.uint32, count=1)[0])
+        offset = 4
+        pos = np.frombuffer(data, dtype=np.int8, count=n, offset=offset)
+        offset += n
+        idx = np.frombuffer(data, dtype=np.int32, count=n, offset=offset)
+        offset += 4 * n
+        lengths = np.frombuffer(data, dtype=np.int32, count=n, offset=offset)
+        offset += 4 * n
+        tags = data[offset:].decode().split("\0") if n > 0 else []
+
+        table = cls.__new__(cls)
+        table.text = np.array([review[i:i + l] for i, l in zip(idx.tolist(), lengths.tolist())], dtype=object)
+        table.pos = pos.copy()
+        table.tag = np.array(tags, dtype=object)
+        table.idx = idx.astype(np.int64)
+        table._word_positions = None
+        table._key_ids = None
+        return table
+
+    def to_bytes(self) :
+        '''
+        Serializes the table compactly: pos codes, token offsets and lengths, and tags. token text is
+        not stored since it can be sliced out of the review again
+        '''
+        lengths = self.end_idx() - self.idx
+        return np.uint32(len(self)).tobytes() + self.pos.tobytes() + self.idx.astype(np.int32).tobytes() \
+            + lengths.astype(np.int32).tobytes() + "\0".join(self.tag.tolist()).encode()
+
+    def __len__(self) :
+        return len(self.text)
+
+    def end_idx(self) :
+        '''
+        Returns the character offset just past the end of each token
+        '''
+        return self.idx + np.fromiter((len(t) for t in self.text), dtype=np.int64, count=len(self.text))
+
+    def pos_tag(self, i) :
+        '''
+        Returns the pos tag string of token i
+        '''
+        return POS_TAGS[self.pos[i]]
+
+    def pos_mask(self, *pos_tags) :
+        '''
+        Returns a boolean mask of tokens whose pos is one of pos_tags
+        '''
+        return np.isin(self.pos, [POS_CODES[p] for p in pos_tags])
+
+    def text_mask(self, words) :
+        '''
+        Returns a boolean mask of tokens whose text is in words
+        '''
+        if not isinstance(words, (set, frozenset, dict)) :
+            words = set(words)
+        return np.fromiter((t in words for t in self.text), dtype=bool, count=len(self.text))
+
+    def word_positions(self) :
+        '''
+        Returns a dict of token text -> positions of the tokens with that text, built once per table
+        '''
+        if self._word_positions is None :
+            word_positions = {}
+            for j, t in enumerate(self.text.tolist()) :
+                word_positions.setdefault(t, []).append(j)
+            self._word_positions = word_positions
+        return self._word_positions
+
+    def key_ids(self) :
+        '''
+        Returns an id per token that is equal for tokens with the same (text, pos, tag), built once per table
+        '''
+        if self._key_ids is None :
+            keys = {}
+            self._key_ids = np.array([keys.setdefault(key, len(keys)) for key in \
+                                      zip(self.text.tolist(), self.pos.tolist(), self.tag.tolist())], dtype=np.int64)
+        return self._key_ids
+
+    def join(self, start, end) :
+        '''
+        Returns the text of tokens start to end (exclusive), each followed by a space
+        '''
+        return "".join([t + " " for t in self.text[start:end]])
+
+    def to_frame(self) :
+        '''
+        Returns the table as a text, pos, tag, idx dataframe
+        '''
+        return pd.DataFrame({'text': self.text, 'pos': [POS_TAGS[p] for p in self.pos], 'tag': self.tag, 'idx': self.idx})
+
+def token_runs(positions) :
+    '''
+    Splits sorted unique token positions into runs of consecutive positions
+
+    Parameters:
+        positions (np.ndarray): sorted unique positions
+
+    Returns:
+        runs (list): (first, last) position of each run
+    '''
+    positions = np.asarray(positions, dtype=np.int64)
+    if len(positions) == 0 :
+        return []
+    breaks = np.flatnonzero(np.diff(positions) != 1)
+    firsts = np.concatenate(([positions[0]], positions[breaks + 1]))
+    lasts = np.concatenate((positions[breaks], [positions[-1]]))
+    return list(zip(firsts.tolist(), lasts.tolist()))